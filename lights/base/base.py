@@ -1,7 +1,11 @@
 from datetime import datetime
 from lights.base.history import History
 from time import time
+from collections import namedtuple
 import numpy as np
+import pandas as pd
+from numba import njit, prange
+from scipy.special import expit
 
 
 class Learner:
@@ -125,13 +129,15 @@ def normalize(X):
     return X_norm
 
 
-def from_ts_to_design_features(Y_il, fixed_effect_time_order):
+def from_ts_to_design_features(times_il, y_il, fixed_effect_time_order):
     """Extracts the design features from a given longitudinal trajectory
 
     Parameters
     ----------
-    Y_il : `pandas.Series`
-        A longitudinal trajectory
+    times_il : `np.ndarray`
+        The measurement times of the longitudinal trajectory
+    y_il : `np.ndarray`
+        The measured values of the longitudinal trajectory
     fixed_effect_time_order : `int`
         Order of fixed effect features
 
@@ -146,8 +152,7 @@ def from_ts_to_design_features(Y_il, fixed_effect_time_order):
     n_il : `list`
         The corresponding number of measurements
     """
-    times_il = Y_il.index.values
-    y_il = Y_il.values.reshape(-1, 1)
+    y_il = y_il.reshape(-1, 1)
     n_il = len(times_il)
     U_il = np.ones(n_il)
     for t in range(1, fixed_effect_time_order + 1):
@@ -158,6 +163,65 @@ def from_ts_to_design_features(Y_il, fixed_effect_time_order):
     return U_il, V_il, y_il, n_il
 
 
+# Longitudinal feature stored as flat arrays, the measurements of the i-th
+# sample being times[offsets[i]:offsets[i + 1]]
+LongData = namedtuple('LongData', ['times', 'values', 'offsets'])
+
+
+def to_long_data(Y):
+    """Converts longitudinal data into one contiguous `LongData` per
+    longitudinal feature
+
+    Parameters
+    ----------
+    Y : `pandas.DataFrame`, shape=(n_samples, n_long_features)
+        The longitudinal data. Each element of the dataframe is a
+        pandas.Series
+
+    Returns
+    -------
+    long_data : `list` of n_long_features `LongData`
+        The longitudinal data, to be used in place of Y
+    """
+    long_data = []
+    for l in range(Y.shape[1]):
+        Y_l = Y.iloc[:, l]
+        lengths = [len(Y_il) for Y_il in Y_l]
+        long_data.append(LongData(
+            times=np.concatenate([Y_il.index.values for Y_il in Y_l]),
+            values=np.concatenate([Y_il.values for Y_il in Y_l]),
+            offsets=np.concatenate(([0], np.cumsum(lengths)))))
+    return long_data
+
+
+def take_long_data(long_data, idx):
+    """Selects samples from longitudinal data stored as `LongData`
+
+    Parameters
+    ----------
+    long_data : `list` of n_long_features `LongData`
+        The longitudinal data
+
+    idx : `np.ndarray`
+        Indices of the samples to select
+
+    Returns
+    -------
+    output : `list` of n_long_features `LongData`
+        The longitudinal data of the selected samples
+    """
+    output = []
+    for times, values, offsets in long_data:
+        starts = offsets[idx]
+        lengths = offsets[idx + 1] - starts
+        new_offsets = np.concatenate(([0], np.cumsum(lengths)))
+        # positions of the selected measurements in the flat arrays
+        pos = np.repeat(starts - new_offsets[:-1], lengths) + \
+            np.arange(new_offsets[-1])
+        output.append(LongData(times[pos], values[pos], new_offsets))
+    return output
+
+
 def extract_features(Y, fixed_effect_time_order):
     """Extract the design features from longitudinal data
 
@@ -165,7 +229,8 @@ def extract_features(Y, fixed_effect_time_order):
     ----------
     Y : `pandas.DataFrame`, shape=(n_samples, n_long_features)
         The longitudinal data. Each element of the dataframe is a
-        pandas.Series
+        pandas.Series. A `list` of `LongData` as given by `to_long_data`
+        is accepted as well
 
     fixed_effect_time_order : `int`
         Order of the higher time monomial considered for the representations of
@@ -197,7 +262,9 @@ def extract_features(Y, fixed_effect_time_order):
     N_L : `list` of L `list`
         Number of longitudinal measurements arranged by l-th order
     """
-    n_samples, n_long_features = Y.shape
+    if isinstance(Y, pd.DataFrame):
+        Y = to_long_data(Y)
+    n_samples, n_long_features = len(Y[0].offsets) - 1, len(Y)
     U, V, y, N = [], [], [], []
     U_L = [[] for _ in range(n_long_features)]
     V_L = [[] for _ in range(n_long_features)]
@@ -205,11 +272,12 @@ def extract_features(Y, fixed_effect_time_order):
     N_L = [[] for _ in range(n_long_features)]
 
     for i in range(n_samples):
-        Y_i = Y.iloc[i]
         U_i, V_i, y_i, N_i = [], [], np.array([]), []
         for l in range(n_long_features):
+            times, values, offsets = Y[l]
+            start, stop = offsets[i], offsets[i + 1]
             U_il, V_il, y_il, N_il = from_ts_to_design_features(
-                Y_i[l], fixed_effect_time_order)
+                times[start:stop], values[start:stop], fixed_effect_time_order)
 
             U_i.append(U_il)
             V_i.append(V_il)
@@ -234,27 +302,63 @@ def extract_features(Y, fixed_effect_time_order):
     return (U, V, y, N), (U_L, V_L, y_L, N_L)
 
 
-def logistic_grad(z):
-    """Overflow proof computation of 1 / (1 + exp(-z)))
+def logistic_grad(z, out=None):
+    """Overflow proof computation of 1 / (1 + exp(-z))), written in out if
+    given
     """
-    idx_pos = np.where(z >= 0.)
-    idx_neg = np.where(z < 0.)
-    res = np.empty(z.shape)
-    res[idx_pos] = 1. / (1. + np.exp(-z[idx_pos]))
-    res[idx_neg] = 1 - 1. / (1. + np.exp(z[idx_neg]))
-    return res
+    return expit(z, out=out)
+
+
+def logistic_loss(z, out=None):
+    """Overflow proof computation of log(1 + exp(-z)), written in out if given
+    """
+    out = np.negative(z, out=out)
+    return np.logaddexp(0., out, out=out)
+
 
+@njit(parallel=True, cache=True)
+def c_index(risk, T, delta):
+    """Harrell's concordance index of a risk score, a higher risk being
+    expected for subjects with an earlier event
 
-def logistic_loss(z):
-    """Overflow proof computation of log(1 + exp(-z))
+    Parameters
+    ----------
+    risk : `np.ndarray`, shape=(n_samples,)
+        The predicted risk score of each subject
+
+    T : `np.ndarray`, shape=(n_samples,)
+        Censored times of the event of interest
+
+    delta : `np.ndarray`, shape=(n_samples,)
+        Censoring indicator
+
+    Returns
+    -------
+    output : `float`
+        The C-index, `nan` if there is no admissible pair or if a risk score
+        is `nan`
     """
-    idx_pos = np.where(z >= 0.)
-    idx_neg = np.where(z < 0.)
-    res = np.empty(z.shape)
-    res[idx_pos] = np.log(1. + np.exp(-z[idx_pos]))
-    z_neg = z[idx_neg]
-    res[idx_neg] = -z_neg + np.log(1. + np.exp(z_neg))
-    return res
+    # a degenerate fit must not score as a random one
+    if np.isnan(risk).any():
+        return np.nan
+    n_samples = T.shape[0]
+    num, den = 0., 0.
+    for i in prange(n_samples):
+        num_i, den_i = 0., 0.
+        if delta[i]:
+            for j in range(n_samples):
+                # subjects censored at an event time are deemed still at risk
+                if T[j] > T[i] or (T[j] == T[i] and not delta[j]):
+                    den_i += 1.
+                    if risk[i] > risk[j]:
+                        num_i += 1.
+                    elif risk[i] == risk[j]:
+                        num_i += .5
+        num += num_i
+        den += den_i
+    if den == 0.:
+        return np.nan
+    return num / den
 
 
 def get_times_infos(T, T_u):
@@ -375,6 +479,8 @@ def clean_xi_ext(xi_ext, fit_intercept):
         negative parts without potential intercept coefficients
     """
     if fit_intercept:
-        n_time_indep_features = len(xi_ext) // 2
-        xi_ext = np.delete(xi_ext, [0, n_time_indep_features + 1])
+        # intercepts are the first entries of both the positive and negative
+        # parts
+        dim = len(xi_ext) // 2
+        xi_ext = np.concatenate((xi_ext[1:dim], xi_ext[dim + 1:]))
     return xi_ext
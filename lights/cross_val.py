@@ -1,13 +1,59 @@
+import os
+import shutil
 import numpy as np
-from sklearn.model_selection import KFold
+from tempfile import mkdtemp
+from joblib import Parallel, delayed, dump, load
+from scipy.stats import loguniform
+from sklearn.model_selection import StratifiedKFold
+from lights.base.base import to_long_data, take_long_data
 from lights.inference import QNMCEM
 
 
+def _fit_score_fold(learner, params, metric, train, test):
+    """Fits a QNMCEM learner on the training part of a fold and scores it on
+    the testing part
+
+    Parameters
+    ----------
+    learner : `QNMCEM`
+        The learner dedicated to the fold. With ``warm_start``, it starts from
+        the solution reached for the previous strength parameters
+
+    params : `tuple`
+        The strength parameters (l_pen_EN, l_pen_SGL_beta, l_pen_SGL_gamma)
+
+    metric : 'log_lik', 'C-index'
+        Either computes log-likelihood or C-index
+
+    train, test : `tuple`
+        The data (X, Y, T, delta) of the training and testing parts of the
+        fold, numerical arrays being memory-mapped
+
+    Returns
+    -------
+    learner : `QNMCEM`
+        The fitted learner, to be reused for the next strength parameters
+
+    score : `float`
+        The score computed on the testing part of the fold, `nan` for a
+        degenerate fit
+    """
+    learner.l_pen_EN, learner.l_pen_SGL_beta, learner.l_pen_SGL_gamma = params
+    learner.fit(*train)
+    score = learner.score(*test, metric)
+    if np.isnan(score):
+        # Do not warm start the next strength parameters from a degenerate
+        # solution
+        learner._fitted = False
+    return learner, score
+
+
 def cross_validate(X, Y, T, delta, n_folds=10, eta=0.1,
                    adaptative_grid_el=True, grid_size=30,
                    grid_params=[(0, 0, 0)], shuffle=True,
                    verbose=True, metric='C-index', tol=1e-5, warm_start=True,
-                   eta_elastic_net=.1, eta_sp_gp_l1=.1):
+                   eta_elastic_net=.1, eta_sp_gp_l1=.1, n_iter=None,
+                   random_state=0, dtype=np.float32, n_jobs=-1, **kwargs):
     """Apply n_folds randomized search cross-validation using the given
     data, to select the best penalization hyper-parameters
 
@@ -38,17 +84,21 @@ def cross_validate(X, Y, T, delta, n_folds=10, eta=0.1,
 
     adaptative_grid_el : `bool`, default=True
         If `True`, adapt the ElasticNet strength parameter grid using the
-        KKT conditions
+        KKT conditions. The grid run through is then made of all the
+        combinations of this grid with the SparseGroupL1 strength parameters
+        found in grid_params
 
     grid_size : `int`, default=30
         Grid size if adaptative_grid_el=`True`
 
     grid_params : list of tuples, default=[(0, 0, 0)]
-        Grid of strength parameters to be run through, if
-        adaptative_grid_el=`False`
+        Grid of strength parameters (l_pen_EN, l_pen_SGL_beta,
+        l_pen_SGL_gamma) to be run through, if adaptative_grid_el=`False`.
+        Otherwise, only its SparseGroupL1 strength parameters are used
 
     shuffle : `bool`, default=True
-        Whether to shuffle the data before splitting into batches
+        Whether to shuffle the data before splitting into batches, stratified
+        on the censoring indicator
 
     verbose : `bool`, default=True
         If `True`, we verbose things, otherwise the solver does not
@@ -56,47 +106,166 @@ def cross_validate(X, Y, T, delta, n_folds=10, eta=0.1,
 
     metric : 'log_lik', 'C-index', default='C-index'
         Either computes log-likelihood or C-index
+
+    n_iter : `int`, default=None
+        If not `None`, number of strength parameters tuples to be sampled
+        log-uniformly within the range given by the KKT conditions, and run
+        through instead of grid_params
+
+    random_state : `int` or `None`, default=0
+        Seed used to shuffle the folds and to sample the strength parameters,
+        so that the folds and the grid run through are reproducible. If
+        `None`, fresh entropy is used
+
+    dtype : `np.dtype`, default=`np.float32`
+        Floating point type to which X and T are cast, single precision
+        being enough to select the strength parameters. Use `np.float64`
+        to run the cross-validation in double precision
+
+    n_jobs : `int`, default=-1
+        Number of processes fitting the folds in parallel, -1 meaning all
+        the processors
+
+    **kwargs
+        All other arguments are forwarded to the `QNMCEM` learners, such as
+        fixed_effect_time_order or max_iter
+
+    Returns
+    -------
+    output : `dict`
+        The cross-validation results, with keys
+
+        - 'params_best' : the strength parameters with the best average score
+        - 'grid_params' : the strength parameters run through
+        - 'avg_scores', 'std_scores' : `np.ndarray`, shape=(n_grid,), the
+          average and standard deviation of the scores over the folds, for
+          each element of grid_params
+        - 'n_scores' : `np.ndarray`, shape=(n_grid,), the number of folds
+          each element of grid_params was scored on, which is lower than
+          n_folds if early stopped
+        - 'learners' : `list` of n_folds `QNMCEM`, the learners fitted on
+          each fold for the last strength parameters run through
     """
+    if n_folds < 2:
+        # the early stopping needs the scores deviation on several folds
+        raise ValueError("``n_folds`` must be at least 2")
+    X = np.ascontiguousarray(X, dtype=dtype)
+    T = np.ascontiguousarray(T, dtype=dtype)
+    delta = np.ascontiguousarray(delta, dtype=np.int8)
     n_samples = T.shape[0]
-    cv = KFold(n_splits=n_folds, shuffle=shuffle)
+    # stratify on the censoring indicator to balance events across folds
+    cv = StratifiedKFold(n_splits=n_folds, shuffle=shuffle,
+                         random_state=random_state if shuffle else None)
 
-    if adaptative_grid_el:
+    if adaptative_grid_el or n_iter is not None:
         # from KKT conditions
-        gamma_max = 1. / np.log(10.) * np.log(
-            1. / (1. - eta_elastic_net) * (.5 / n_samples)
-            * np.absolute(X).sum(axis=0).max())
-
+        col_abs_max = np.linalg.norm(X, ord=1, axis=0).max()
+        gamma_max = np.log10(.5 / (n_samples * (1. - eta_elastic_net))
+                             * col_abs_max)
         # TODO: Update KKT conditions for all hyper-params
+
+    if n_iter is not None:
+        # Randomized search over the three strength parameters
+        rng = np.random.default_rng(random_state)
+        sampled = loguniform.rvs(10 ** (gamma_max - 4), 10 ** gamma_max,
+                                 size=(n_iter, 3), random_state=rng)
+        grid_params = list(map(tuple, sampled))
+    elif adaptative_grid_el:
         grid_elastic_net = np.logspace(gamma_max - 4, gamma_max, grid_size)
+        # ElasticNet strengths given by the KKT grid, crossed with the
+        # SparseGroupL1 ones of grid_params
+        grid_sp_gp_l1 = list(dict.fromkeys(
+            (l_pen_SGL_beta, l_pen_SGL_gamma)
+            for _, l_pen_SGL_beta, l_pen_SGL_gamma in grid_params))
+        grid_params = [(l_pen_EN, l_pen_SGL_beta, l_pen_SGL_gamma)
+                       for l_pen_EN in grid_elastic_net
+                       for l_pen_SGL_beta, l_pen_SGL_gamma in grid_sp_gp_l1]
+
+    # Split and slice the data once, the folds being shared by all grid
+    # points. Numerical arrays are memory-mapped so that workers read their
+    # fold instead of receiving a copy of it
+    long_data = to_long_data(Y)
+    folder = mkdtemp()
+
+    def memmap(arr, name):
+        return load(dump(arr, os.path.join(folder, name))[0], mmap_mode='r')
+
+    folds = []
+    for n_fold, (idx_train, idx_test) in enumerate(cv.split(X, delta)):
+        folds.append(tuple(
+            (memmap(X[idx], 'X_%s_%d' % (part, n_fold)),
+             take_long_data(long_data, idx),
+             memmap(T[idx], 'T_%s_%d' % (part, n_fold)),
+             memmap(delta[idx], 'delta_%s_%d' % (part, n_fold)))
+            for part, idx in [('train', idx_train), ('test', idx_test)]))
 
     learners = [
-        QNMCEM(verbose=False, tol=tol, warm_start=warm_start)
+        QNMCEM(verbose=False, tol=tol, warm_start=warm_start,
+               eta_elastic_net=eta_elastic_net, eta_sp_gp_l1=eta_sp_gp_l1,
+               **kwargs)
         for _ in range(n_folds)
     ]
 
+    # Run through the grid along a decreasing regularization path, so that
+    # each fit warm starts close to its solution
     n_grid = len(grid_params)
-    scores = np.empty((n_grid, n_folds))
-    if verbose is not None:
-        verbose = verbose
-    for idx, params in enumerate(grid_params):
-        if verbose:
-            print("Testing l_pen_EN=%.2e, l_pen_SGL_beta=%.2e, "
-                  "l_pen_SGL_gamma=%.2e" % params, "on fold ", end="")
-        for n_fold, (idx_train, idx_test) in enumerate(cv.split(X)):
+    l_pen_EN, l_pen_SGL_beta, l_pen_SGL_gamma = np.array(grid_params).T
+    order = np.lexsort((-l_pen_SGL_gamma, -l_pen_SGL_beta, -l_pen_EN))
+    # Running mean and sum of squared deviations (Welford) of the scores
+    avg_scores = np.zeros(n_grid)
+    sq_dev_scores = np.zeros(n_grid)
+    n_scores = np.zeros(n_grid, dtype=int)
+    # Number of folds run before possibly early stopping a grid point
+    n_folds_min = min(3, n_folds)
+    best_score = -np.inf
+    try:
+        for idx in order:
+            params = grid_params[idx]
             if verbose:
-                print(" " + str(n_fold), end="")
-            X_train, X_test = X[idx_train], X[idx_test]
-            T_train, T_test = Y[idx_train], T[idx_test]
-            delta_train, delta_test = delta[idx_train], delta[idx_test]
-            learner = learners[n_fold]
-            learner.l_pen_EN, l_pen_SGL_beta, l_pen_SGL_gamma = params
-            learner.fit(X_train, T_train, delta_train)
-            scores[idx, n_fold] = learner.score(
-                X_test, T_test, delta_test, metric)
-        if verbose:
-            print(": avg_score=%.2e" % scores[idx, :].mean())
-
-    avg_scores = scores.mean(1)
-    std_scores = scores.std(1)
-    idx_best = avg_scores.argmax()
+                print("Testing l_pen_EN=%.2e, l_pen_SGL_beta=%.2e, "
+                      "l_pen_SGL_gamma=%.2e" % params, "on fold ", end="")
+            for start, stop in [(0, n_folds_min), (n_folds_min, n_folds)]:
+                if start == stop:
+                    break
+                # Folds are independent, hence fitted in parallel
+                results = Parallel(n_jobs=n_jobs, prefer='processes',
+                                   max_nbytes=None)(
+                    delayed(_fit_score_fold)(learners[n_fold], params, metric,
+                                             *fold)
+                    for n_fold, fold in enumerate(folds[start:stop], start))
+                for n_fold, (learner, score) in enumerate(results, start):
+                    learners[n_fold] = learner
+                    n_scores[idx] += 1
+                    dev = score - avg_scores[idx]
+                    avg_scores[idx] += dev / n_scores[idx]
+                    sq_dev_scores[idx] += dev * (score - avg_scores[idx])
+                if verbose:
+                    print(" ".join(map(str, range(start, stop))), end=" ")
+                # Skip remaining folds if params are unlikely to beat the
+                # best, folds being exchangeable the remaining ones are
+                # predicted by the completed ones statistics
+                mu = avg_scores[idx]
+                sigma = np.sqrt(sq_dev_scores[idx] / (n_scores[idx] - 1))
+                # A nan score on a fold leaves the params unscored, hence
+                # skipped by the selection
+                if stop < n_folds and (np.isnan(mu)
+                                       or mu + sigma < best_score - tol):
+                    if verbose:
+                        print("(early stopped)", end="")
+                    break
+            best_score = np.fmax(best_score, avg_scores[idx])
+            if verbose:
+                print(": avg_score=%.2e" % avg_scores[idx])
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    std_scores = np.sqrt(sq_dev_scores / np.maximum(n_scores - 1, 1))
+    # A fold without any admissible pair for the C-index scores nan
+    if np.isnan(avg_scores).all():
+        raise RuntimeError("No strength parameters could be scored")
+    idx_best = int(np.nanargmax(avg_scores))
     params_best = grid_params[idx_best]
+
+    return {'params_best': params_best, 'grid_params': grid_params,
+            'avg_scores': avg_scores, 'std_scores': std_scores,
+            'n_scores': n_scores, 'learners': learners}
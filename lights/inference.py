@@ -1,15 +1,18 @@
 import numpy as np
 import pandas as pd
 import copt
+import numba
 import warnings
-from scipy.optimize import fmin_l_bfgs_b
+from scipy.optimize import minimize
+from scipy.special import logsumexp
+from joblib import Parallel, delayed
 from numpy.linalg import multi_dot
-from lifelines.utils import concordance_index as c_index_score
 from lights.base.base import Learner, extract_features, normalize, block_diag, \
     get_xi_from_xi_ext, logistic_grad, get_times_infos, get_ext_from_vect, \
-    get_vect_from_ext
+    get_vect_from_ext, c_index
 from lights.init.mlmm import MLMM
 from lights.init.cox import initialize_asso_params
+from lights.model.associations import AssociationFunctions
 from lights.model.e_step_functions import EstepFunctions
 from lights.model.m_step_functions import MstepFunctions
 from lights.model.regularizations import ElasticNet, SparseGroupL1
@@ -60,7 +63,9 @@ class QNMCEM(Learner):
         iterations
 
     warm_start : `bool`, default=True
-        If true, learning will start from the last reached solution
+        If true, learning will start from the last reached solution, and the
+        proximal gradient updates from the previous QNMCEM iterate (the
+        L-BFGS-B ones always do)
 
     fixed_effect_time_order : `int`, default=5
         Order of the higher time monomial considered for the representations of
@@ -91,6 +96,11 @@ class QNMCEM(Learner):
     MC_sep: `bool`, default=False
         If `False`, we use the same set of MC samples for all subject,
         otherwise we sample a seperate set of MC samples for each subject
+
+    n_jobs : `int`, default=1
+        Number of threads used to run the M-step updates of the latent groups
+        in parallel. With n_jobs > 1, numba must use a thread-safe threading
+        layer (tbb or omp)
     """
 
     def __init__(self, fit_intercept=False, l_pen_EN=0., l_pen_SGL_beta=0.,
@@ -98,7 +108,7 @@ class QNMCEM(Learner):
                  max_iter=100, verbose=True, print_every=10, tol=1e-5,
                  warm_start=True, fixed_effect_time_order=5,
                  asso_functions='all', initialize=True, copt_accelerate=False,
-                 compute_obj=False, MC_sep=False):
+                 compute_obj=False, MC_sep=False, n_jobs=1):
         Learner.__init__(self, verbose=verbose, print_every=print_every)
         self.max_iter = max_iter
         self.tol = tol
@@ -117,6 +127,7 @@ class QNMCEM(Learner):
         self._fitted = False
         self.compute_obj = compute_obj
         self.MC_sep = MC_sep
+        self.n_jobs = n_jobs
 
         # Attributes that will be instantiated afterwards
         self.n_samples = None
@@ -124,6 +135,7 @@ class QNMCEM(Learner):
         self.n_long_features = None
         self.S = None
         self.T_u = None
+        self.asso_feat = None
         self.theta = {
             "beta_0": np.empty(1),
             "beta_1": np.empty(1),
@@ -179,7 +191,7 @@ class QNMCEM(Learner):
         return rel
 
     @staticmethod
-    def _log_lik(pi_xi, f_mean):
+    def _log_lik(pi_xi, log_f_mean):
         """Computes the approximation of the likelihood of the lights model
 
         Parameters
@@ -188,19 +200,68 @@ class QNMCEM(Learner):
             Probability estimates for being on the high-risk group given
             time-independent features
 
-        f_mean : `np.ndarray`, shape=(n_samples, K)
-            The mean value of f(Y, T, delta| S, G ; theta) over S
+        log_f_mean : `np.ndarray`, shape=(n_samples, K)
+            The logarithm of the mean value of f(Y, T, delta| S, G ; theta)
+            over S
 
         Returns
         -------
         prb : `float`
             The approximated log-likelihood computed on the given data
         """
-        pi_xi_ = np.vstack((1 - pi_xi, pi_xi)).T
-        prb = np.log((pi_xi_ * f_mean).sum(axis=-1)).mean()
+        with np.errstate(divide='ignore'):
+            log_pi_xi_ = np.log(np.vstack((1 - pi_xi, pi_xi)).T)
+        prb = logsumexp(log_pi_xi_ + log_f_mean, axis=-1).mean()
         return prb
 
-    def _func_obj(self, pi_xi, f_mean):
+    def _log_f_mean(self, log_f, extracted_features):
+        """Computes the logarithm of the mean value of
+        f(Y, T, delta| S, G ; theta) over S
+
+        Parameters
+        ----------
+        log_f : `np.ndarray`, shape=(n_samples, K, N_MC)
+            The logarithm of f(Y, T, delta| S, G ; theta)
+
+        extracted_features :  `tuple, tuple`,
+            The extracted features from longitudinal data.
+            Each tuple is a combination of fixed-effect design features,
+            random-effect design features, outcomes, number of the longitudinal
+            measurements for all subject or arranged by l-th order.
+
+        Returns
+        -------
+        log_f_mean : `np.ndarray`, shape=(n_samples, K)
+            The logarithm of the mean value of f(Y, T, delta| S, G ; theta)
+            over S
+        """
+        log_f_mean = logsumexp(log_f, axis=-1) - np.log(log_f.shape[-1])
+        if self.MC_sep:
+            log_f_mean += self.mlmm_density(extracted_features)
+        return log_f_mean
+
+    @staticmethod
+    def _rescale_density(log_f):
+        """Exponentiates f(Y, T, delta| S, G ; theta) up to a factor per
+        subject, the largest value of each subject being set to 1. The
+        posterior probabilities and the approximated expectations being
+        invariant to such factors, it avoids the underflow of f
+
+        Parameters
+        ----------
+        log_f : `np.ndarray`, shape=(n_samples, K, N_MC)
+            The logarithm of f(Y, T, delta| S, G ; theta)
+
+        Returns
+        -------
+        f : `np.ndarray`, shape=(n_samples, K, N_MC)
+            The rescaled value of f(Y, T, delta| S, G ; theta)
+        """
+        f = log_f - log_f.max(axis=(1, 2), keepdims=True)
+        np.exp(f, out=f)
+        return f
+
+    def _func_obj(self, pi_xi, log_f_mean):
         """The global objective to be minimized by the QNMCEM algorithm
         (including penalization)
 
@@ -210,8 +271,9 @@ class QNMCEM(Learner):
             Probability estimates for being on the high-risk group given
             time-independent features
 
-        f_mean : `np.ndarray`, shape=(n_samples, K)
-            The mean value of f(Y, T, delta| S, G ; theta) over S
+        log_f_mean : `np.ndarray`, shape=(n_samples, K)
+            The logarithm of the mean value of f(Y, T, delta| S, G ; theta)
+            over S
 
         Returns
         -------
@@ -223,7 +285,7 @@ class QNMCEM(Learner):
         l_pen_SGL_beta = self.l_pen_SGL_beta
         l_pen_SGL_gamma = self.l_pen_SGL_gamma
         theta = self.theta
-        log_lik = self._log_lik(pi_xi, f_mean)
+        log_lik = self._log_lik(pi_xi, log_f_mean)
         # xi elastic net penalty
         xi = theta["xi"]
         xi_pen = self.ENet.pen(xi)
@@ -305,11 +367,11 @@ class QNMCEM(Learner):
         intensity : `np.ndarray`, shape=(N_MC, K, n_samples)
             The value of intensity
         """
-        intensity = (rel_risk * indicator).sum(axis=-1)
+        intensity = np.einsum('mkij,ij->mki', rel_risk, indicator)
         return intensity
 
     @staticmethod
-    def survival(rel_risk, indicator):
+    def survival(rel_risk, indicator, log=False):
         """Computes the survival function
 
         Parameters
@@ -320,15 +382,24 @@ class QNMCEM(Learner):
         indicator: `np.ndarray`, shape=(n_samples, J)
             The indicator matrix for comparing event times (T <= T_u)
 
+        log : `boolean`, default=False
+            If `True`, the logarithm of the survival function is computed
+            instead
+
         Returns
         -------
         survival : `np.ndarray`, shape=(n_samples, K, N_MC)
             The value of the survival function
         """
-        survival = np.exp(-(rel_risk * indicator).sum(axis=-1).T)
+        # reduced without the product temporary, the exponential being then
+        # taken in place
+        survival = np.einsum('mkij,ij->ikm', rel_risk, indicator)
+        np.negative(survival, out=survival)
+        if not log:
+            np.exp(survival, out=survival)
         return survival
 
-    def f_y_given_latent(self, extracted_features, g3):
+    def f_y_given_latent(self, extracted_features, g3, log=False):
         """Computes the density of the longitudinal processes given latent
         variables
 
@@ -343,25 +414,29 @@ class QNMCEM(Learner):
         g3 : `list` of n_samples `np.array`s with shape=(K, n_i, N_MC)
             The values of g3 function
 
+        log : `boolean`, default=False
+            If `True`, the logarithm of the density is computed instead
+
         Returns
         -------
         f_y : `np.ndarray`, shape=(n_samples, K, N_MC)
             The value of the f(Y | S, G ; theta)
         """
         (U_list, V_list, y_list, N_list) = extracted_features[0]
-        n_samples, n_long_features = self.n_samples, self.n_long_features
+        n_samples, n_long_features = len(y_list), self.n_long_features
         phi = self.theta["phi"]
         N_MC = g3[0].shape[2]
         K = 2  # 2 latent groups
-        f_y = np.ones(shape=(n_samples, K, N_MC))
+        f_y = np.zeros(shape=(n_samples, K, N_MC))
         for i in range(n_samples):
             n_i, y_i, M_iS = sum(N_list[i]), y_list[i], g3[i]
             inv_Phi_i = [[phi[l, 0]] * N_list[i][l] for l in
                          range(n_long_features)]
             inv_Phi_i = np.concatenate(inv_Phi_i).reshape(-1, 1)
-            f_y[i] = (1 / (np.sqrt(((2 * np.pi) ** n_i) * np.prod(inv_Phi_i)))
-                      * np.exp(
-                        np.sum(-0.5 * ((y_i - M_iS) ** 2) / inv_Phi_i, axis=1)))
+            f_y[i] = -.5 * (n_i * np.log(2 * np.pi) + np.log(inv_Phi_i).sum()
+                            + np.sum((y_i - M_iS) ** 2 / inv_Phi_i, axis=1))
+        if not log:
+            np.exp(f_y, out=f_y)
         return f_y
 
     def mlmm_density(self, extracted_features):
@@ -377,11 +452,12 @@ class QNMCEM(Learner):
 
         Returns
         -------
-        output : `float`
-            The value of the log-likelihood
+        log_lik : `np.ndarray`, shape=(n_samples, K)
+            The value of the log-likelihood of each subject, not exponentiated
+            so that it does not underflow for many measurements
         """
         (U_list, V_list, y_list, N), (U_L, V_L, y_L, N_L) = extracted_features
-        n_samples, n_long_features = len(U_list), len(U_L)
+        n_samples = len(U_list)
         theta = self.theta
         D, phi = theta["long_cov"], theta["phi"]
         beta_0, beta_1 = theta["beta_0"], theta["beta_1"]
@@ -390,21 +466,21 @@ class QNMCEM(Learner):
         log_lik = np.zeros((n_samples, 2))
         for i in range(n_samples):
             U_i, V_i, y_i, n_i = U_list[i], V_list[i], y_list[i], sum(N[i])
-            inv_Phi_i = [[phi[l, 0]] * N[i][l] for l in range(n_long_features)]
-            inv_Sigma_i = np.diag(np.concatenate(inv_Phi_i))
-            tmp_1 = multi_dot([V_i, D, V_i.T]) + inv_Sigma_i
+            tmp_1 = multi_dot([V_i, D, V_i.T])
+            # add inv_Sigma_i on the diagonal
+            tmp_1.flat[::n_i + 1] += np.repeat(phi[:, 0], N[i])
             tmp_2 = y_i - U_i.dot(beta_stack)
 
             op1 = n_i * np.log(2 * np.pi)
-            op2 = np.log(np.linalg.det(tmp_1))
+            op2 = np.linalg.slogdet(tmp_1)[1]
             op3 = np.diag(multi_dot([tmp_2.T, np.linalg.inv(tmp_1), tmp_2]))
 
-            log_lik[i] = np.exp(-.5 * (op1 + op2 + op3))
+            log_lik[i] = -.5 * (op1 + op2 + op3)
 
         return log_lik
 
     def f_data_given_latent(self, X, extracted_features, T, T_u, delta, S,
-                            MC_sep):
+                            MC_sep, log=False, E_func=None):
         """Estimates the data density given latent variables
 
         Parameters
@@ -434,6 +510,13 @@ class QNMCEM(Learner):
         If `False`, we use the same set of MC samples for all subject,
         otherwise we sample a seperate set of MC samples for each subject
 
+        log : `boolean`, default=False
+            If `True`, the logarithm of the density is computed instead
+
+        E_func : `EstepFunctions`, default=None
+            The E-step functions on the same data, whose g1 is then shared
+            with the M-step. Built if `None`
+
         Returns
         -------
         f : `np.ndarray`, shape=(n_samples, K, N_MC)
@@ -441,8 +524,10 @@ class QNMCEM(Learner):
         """
         theta, alpha = self.theta, self.fixed_effect_time_order
         baseline_hazard, phi = theta["baseline_hazard"], theta["phi"]
-        E_func = EstepFunctions(X, T, T_u, delta, extracted_features, alpha,
-                                self.asso_functions, theta, MC_sep)
+        if E_func is None:
+            E_func = EstepFunctions(X, T, T_u, delta, extracted_features,
+                                    alpha, self.asso_functions, theta, MC_sep,
+                                    asso_feat=self.asso_feat)
         beta_0, beta_1 = theta["beta_0"], theta["beta_1"]
         gamma_0, gamma_1 = theta["gamma_0"], theta["gamma_1"]
         gamma_0_x, gamma_1_x = theta["gamma_0_x"], theta["gamma_1_x"]
@@ -453,12 +538,16 @@ class QNMCEM(Learner):
         rel_risk = g1.swapaxes(0, 2) * baseline_val
         _, ind_1, ind_2 = get_times_infos(T, T_u)
         intensity = self.intensity(rel_risk, ind_1)
-        survival = self.survival(rel_risk, ind_2)
-        f = (intensity ** delta).T * survival
+        # the density is accumulated in log scale, its factors being
+        # exponentiated only once
+        log_f = self.survival(rel_risk, ind_2, log=True)
+        event = delta == 1
+        log_f[event] += np.log(intensity[..., event]).T
         if not self.MC_sep:
-            f_y = self.f_y_given_latent(extracted_features, g3)
-            f *= f_y
-        return f
+            log_f += self.f_y_given_latent(extracted_features, g3, log=True)
+        if not log:
+            np.exp(log_f, out=log_f)
+        return log_f
 
     def predict_marker(self, X, Y, prediction_times=None):
         """Marker rule of the lights model for being on the high-risk group
@@ -470,7 +559,7 @@ class QNMCEM(Learner):
 
         Y : `pandas.DataFrame`, shape=(n_samples, n_long_features)
             The longitudinal data. Each element of the dataframe is
-            a pandas.Series
+            a pandas.Series. A `list` of `LongData` is accepted as well
 
         prediction_times : `np.ndarray`, shape=(n_samples,), default=None
             Times for prediction, that is up to which one has longitudinal data.
@@ -497,8 +586,10 @@ class QNMCEM(Learner):
             # predictions for alive subjects only
             delta_prediction = np.zeros(n_samples)
             T_u = self.T_u
-            f = self.f_data_given_latent(X, ext_feat, prediction_times, T_u,
-                                         delta_prediction, self.S, self.MC_sep)
+            log_f = self.f_data_given_latent(X, ext_feat, prediction_times,
+                                             T_u, delta_prediction, self.S,
+                                             self.MC_sep, log=True)
+            f = self._rescale_density(log_f)
             pi_xi = self._get_proba(X)
             marker = self._get_post_proba(pi_xi, f.mean(axis=-1))
             return marker
@@ -529,7 +620,7 @@ class QNMCEM(Learner):
 
         Y : `pandas.DataFrame`, shape=(n_samples, n_long_features)
             The longitudinal data. Each element of the dataframe is
-            a pandas.Series
+            a pandas.Series. A `list` of `LongData` is accepted as well
 
         T : `np.ndarray`, shape=(n_samples,)
             Censored times of the event of interest
@@ -546,12 +637,14 @@ class QNMCEM(Learner):
         fit_intercept = self.fit_intercept
         alpha = self.fixed_effect_time_order
         n_samples, p = X.shape
-        L = Y.shape[1]
+        ext_feat = extract_features(Y, alpha)  # Features extraction
+        L = len(ext_feat[1][0])
         self.n_samples = n_samples
         self.n_time_indep_features = p
         self.n_long_features = L
         q_l = alpha + 1
         r_l = 2  # Affine random effects
+        K = 2  # 2 latent groups
         if fit_intercept:
             p += 1
 
@@ -564,73 +657,97 @@ class QNMCEM(Learner):
         N = 10  # Number of initial Monte Carlo sample for S
 
         X = normalize(X)  # Normalize time-independent features
-        ext_feat = extract_features(Y, alpha)  # Features extraction
         T_u = np.unique(T)
+        # Previous solution is only relevant on the same censored times
+        warm_restart = warm_start and self._fitted and \
+            np.array_equal(T_u, self.T_u)
         self.T_u = T_u
+        # Association features only depend on T_u, built once for the fit
+        self.asso_feat = AssociationFunctions(asso_functions, T_u, alpha,
+                                              L).get_asso_feat()
         J, ind_1, ind_2 = get_times_infos(T, T_u)
-
-        # Initialization
-        # TODO: for debugging and update hyper-params if not useful
-        xi_ext = .5 * np.concatenate((np.ones(p), np.zeros(p)))
-
-        if self.initialize:
-            # Initialize longitudinal submodels
-            mlmm = MLMM(max_iter=max_iter, verbose=verbose, tol=tol,
-                        print_every=print_every, fixed_effect_time_order=alpha)
-            mlmm.fit(ext_feat)
-            beta = mlmm.fixed_effect_coeffs
-            D = mlmm.long_cov
-            phi = mlmm.phi
-            est = initialize_asso_params(X, T, delta)
-            time_indep_cox_coeffs, baseline_hazard = est
+        # Indicators as floats, converted once for all M-step evaluations
+        ind_1, ind_2 = ind_1.astype(float), ind_2.astype(float)
+        self.ENet = ElasticNet(self.l_pen_EN, self.eta_elastic_net)
+
+        if warm_restart:
+            # Start from the solution reached by the previous fit
+            theta = self.theta
+            xi = theta["xi"]
+            if fit_intercept:
+                xi = np.append(theta["xi_0"], xi)
+            xi_ext = get_ext_from_vect(xi).flatten()
+            beta_0, beta_1 = theta["beta_0"], theta["beta_1"]
+            D, phi = theta["long_cov"], theta["phi"]
+            baseline_hazard = theta["baseline_hazard"]
+            gamma_0, gamma_1 = theta["gamma_0"], theta["gamma_1"]
+            gamma_0_x, gamma_1_x = theta["gamma_0_x"], theta["gamma_1_x"]
         else:
-            # Fixed initialization
-            q = q_l * L
-            r = r_l * L
-            beta = np.zeros((q, 1))
-            D = np.diag(np.ones(r))
-            phi = np.ones((L, 1))
-            time_indep_cox_coeffs = np.zeros(p)
-            baseline_hazard = pd.Series(data=.5 * np.ones(J), index=T_u)
-
-        # TODO: for debugging and update hyper-params if not useful
-        gamma_0_x = time_indep_cox_coeffs.reshape(-1, 1)
+            # Initialization
+            # TODO: for debugging and update hyper-params if not useful
+            xi_ext = .5 * np.concatenate((np.ones(p), np.zeros(p)))
+
+            if self.initialize:
+                # Initialize longitudinal submodels
+                mlmm = MLMM(max_iter=max_iter, verbose=verbose, tol=tol,
+                            print_every=print_every,
+                            fixed_effect_time_order=alpha)
+                mlmm.fit(ext_feat)
+                beta = mlmm.fixed_effect_coeffs
+                D = mlmm.long_cov
+                phi = mlmm.phi
+                est = initialize_asso_params(X, T, delta)
+                time_indep_cox_coeffs, baseline_hazard = est
+            else:
+                # Fixed initialization
+                q = q_l * L
+                r = r_l * L
+                beta = np.zeros((q, 1))
+                D = np.diag(np.ones(r))
+                phi = np.ones((L, 1))
+                time_indep_cox_coeffs = np.zeros(p)
+                baseline_hazard = pd.Series(data=.5 * np.ones(J), index=T_u)
+
+            # TODO: for debugging and update hyper-params if not useful
+            gamma_0_x = time_indep_cox_coeffs.reshape(-1, 1)
+            gamma_0 = 1e-4 * np.ones((L * nb_asso_param, 1))
+            gamma_1_x = gamma_0_x.copy()
+            gamma_1 = gamma_0.copy()
+            beta_0 = beta.reshape(-1, 1)
+            beta_1 = beta_0.copy()
         gamma_0_x_ext = get_ext_from_vect(gamma_0_x)
-        gamma_0 = 1e-4 * np.ones((L * nb_asso_param, 1))
-        gamma_1_x = gamma_0_x.copy()
-        gamma_1_x_ext = gamma_0_x_ext.copy()
-        gamma_1 = gamma_0.copy()
-        beta_0 = beta.reshape(-1, 1)
-        beta_1 = beta_0.copy()
+        gamma_1_x_ext = get_ext_from_vect(gamma_1_x)
 
         self._update_theta(beta_0=beta_0, beta_1=beta_1, xi=xi_ext,
                            gamma_0=gamma_0, gamma_1=gamma_1,
                            gamma_0_x=gamma_0_x, gamma_1_x=gamma_1_x, long_cov=D,
                            phi=phi, baseline_hazard=baseline_hazard)
 
-        # Stopping criteria and bounds vector for the L-BGFS-B algorithm
-        maxiter, pgtol = 60, 1e-5
+        # Stopping criteria and bounds vector for the L-BGFS-B algorithm, a
+        # short memory being enough for these low-dimensional sub problems.
+        # maxiter and gtol are then scheduled along the QNMCEM iterations
+        lbfgs_options = {'maxiter': 60, 'gtol': 1e-5, 'maxcor': 5}
         bounds_xi = [(0, None)] * 2 * p
         bounds_gamma_time_indep = [(0, None)] * 2 * p
 
         # Instanciates E-step and M-step functions
         E_func = EstepFunctions(X, T, T_u, delta, ext_feat, alpha,
-                                asso_functions, self.theta, self.MC_sep)
+                                asso_functions, self.theta, self.MC_sep,
+                                asso_feat=self.asso_feat)
         F_func = MstepFunctions(fit_intercept, X, T, delta, L, p, self.l_pen_EN,
-                                self.eta_elastic_net, alpha, asso_functions)
+                                self.eta_elastic_net, alpha, asso_functions,
+                                asso_feat=self.asso_feat)
 
         S = E_func.construct_MC_samples(N)
-        f = self.f_data_given_latent(X, ext_feat, T, self.T_u, delta, S,
-                                     self.MC_sep)
+        log_f = self.f_data_given_latent(X, ext_feat, T, self.T_u, delta, S,
+                                         self.MC_sep, log=True, E_func=E_func)
+        f = self._rescale_density(log_f)
         Lambda_1 = E_func.Lambda_g(np.ones(shape=(n_samples, 2, 2 * N)), f)
         pi_xi = self._get_proba(X)
 
         # Store init values
         if self.compute_obj:
-            f_mean = f.mean(axis=-1)
-            if self.MC_sep:
-                f_mean *= self.mlmm_density(ext_feat)
-            obj = self._func_obj(pi_xi, f_mean)
+            obj = self._func_obj(pi_xi, self._log_f_mean(log_f, ext_feat))
             self.history.update(n_iter=0, obj=obj,
                                 rel_obj=np.inf, theta=self.theta)
         else:
@@ -638,12 +755,26 @@ class QNMCEM(Learner):
 
         prev_theta = self.theta.copy()
         rel_theta_list = [0] * 4
+        rel_theta = np.inf
 
         if verbose:
             self.history.print_history()
 
+        # Each latent group update only depends on the other group through
+        # its previous iterate, hence the K updates are run in parallel
+        parallel = Parallel(n_jobs=min(self.n_jobs, K), prefer='threads')
+        # The numba parallel kernels of the M-step are then called from worker
+        # threads, their threading layer must be launched from the main thread
+        # beforehand, otherwise the interpreter hangs at exit
+        numba.get_num_threads()
+
         for n_iter in range(1, max_iter + 1):
 
+            # Inexact L-BFGS-B solves while far from convergence, tightened
+            # as the parameters settle
+            lbfgs_options['gtol'] = max(1e-5, min(1e-2, .1 * rel_theta))
+            lbfgs_options['maxiter'] = min(60, 10 * n_iter)
+
             # E-Step
             pi_est = self._get_post_proba(pi_xi, Lambda_1)
             E_g4 = E_func.Eg(E_func.g4(S), Lambda_1, pi_xi, f)
@@ -658,76 +789,93 @@ class QNMCEM(Learner):
             def E_log_g1(gamma_0_, gamma_0_x_, beta_0_,
                          gamma_1_, gamma_1_x_, beta_1_):
                 return E_func.Eg(
-                    np.log(E_func.g1(S, gamma_0_, gamma_0_x_, beta_0_, gamma_1_,
-                                     gamma_1_x_, beta_1_)), Lambda_1, pi_xi, f)
+                    E_func.g1(S, gamma_0_, gamma_0_x_, beta_0_, gamma_1_,
+                              gamma_1_x_, beta_1_, log=True),
+                    Lambda_1, pi_xi, f)
 
             def E_g6(gamma_0_, gamma_0_x_, beta_0_,
                      gamma_1_, gamma_1_x_, beta_1_):
-                return E_func.Eg(
-                    E_func.g6(S, gamma_0_, gamma_0_x_, beta_0_, gamma_1_,
-                              gamma_1_x_, beta_1_),
-                    Lambda_1, pi_xi, f)
+                return E_func.Eg6(S, gamma_0_, gamma_0_x_, beta_0_, gamma_1_,
+                                  gamma_1_x_, beta_1_, Lambda_1, pi_xi, f)
 
             # M-Step
             D = E_g4.sum(axis=0) / n_samples  # D update
-
+            # Monte Carlo samples drawn with the previous D only span its
+            # range, so that D degenerates along the iterations: floor its
+            # eigenvalues to keep it positive definite
+            eig_val, eig_vec = np.linalg.eigh(D)
+            eig_val = np.maximum(eig_val, 1e-4 * eig_val.max())
+            D = (eig_vec * eig_val).dot(eig_vec.T)
+
+            # L-BFGS-B solves always start from the previous iterate, pi_est
+            # moving only slightly between two QNMCEM iterations
+            xi_init = xi_ext
+            gamma_x_init = [gamma_0_x_ext.flatten(), gamma_1_x_ext.flatten()]
             if warm_start:
-                xi_init = xi_ext
                 beta_init = [beta_0.flatten(), beta_1.flatten()]
-                gamma_x_init = [gamma_0_x_ext.flatten(),
-                                gamma_1_x_ext.flatten()]
                 gamma_init = [gamma_0.flatten(), gamma_1.flatten()]
             else:
-                xi_init = np.zeros(2 * p)
                 beta_init = [np.zeros(L * q_l),
                              np.zeros(L * q_l)]
-                gamma_x_init = [np.zeros(2 * p), np.zeros(2 * p)]
                 gamma_init = [np.zeros(L * nb_asso_param),
                               np.zeros(L * nb_asso_param)]
 
             # xi update
-            xi_ext = fmin_l_bfgs_b(
-                func=lambda xi_ext_: F_func.P_pen_func(pi_est, xi_ext_),
-                x0=xi_init,
-                fprime=lambda xi_ext_: F_func.grad_P_pen(pi_est, xi_ext_),
-                disp=False, bounds=bounds_xi, maxiter=maxiter, pgtol=pgtol)[0]
-
-            # beta_0 update
+            xi_ext = minimize(
+                fun=lambda xi_ext_: F_func.P_pen_func_and_grad(pi_est,
+                                                               xi_ext_),
+                x0=xi_init, jac=True, method='L-BFGS-B', bounds=bounds_xi,
+                options=lbfgs_options).x
+
+            def E_funcs(params, idx):
+                """E_g1, E_log_g1 and E_g6 as functions of the idx-th
+                parameter, the other ones being fixed to params
+                """
+                params = list(params)
+
+                def set_param(v):
+                    params_ = list(params)
+                    params_[idx] = v
+                    return params_
+
+                return {"E_g1": lambda v: E_g1(*set_param(v)),
+                        "E_log_g1": lambda v: E_log_g1(*set_param(v)),
+                        "E_g6": lambda v: E_g6(*set_param(v))}
+
+            # (gamma_k, gamma_k_x, beta_k) for k = 0, 1
+            params = [gamma_0, gamma_0_x, beta_0, gamma_1, gamma_1_x, beta_1]
+
+            # beta update
             eta_sp_gp_l1 = self.eta_sp_gp_l1
             l_pen_SGL_beta = self.l_pen_SGL_beta
             pi_est_K = np.vstack((1 - pi_est, pi_est))
             gamma_K = [gamma_0, gamma_1]
             groups = np.arange(0, len(beta_0)).reshape(L, -1).tolist()
             prox = SparseGroupL1(l_pen_SGL_beta, eta_sp_gp_l1, groups).prox
+            # constant along the M-step
+            baseline_ind_2 = ind_2 * baseline_hazard.values.flatten()
             args_all = {"pi_est": pi_est_K, "E_g5": E_g5, "E_g4": E_g4,
-                        "gamma": gamma_K, "baseline_hazard": baseline_hazard,
+                        "gamma": gamma_K, "baseline_ind_2": baseline_ind_2,
                         "extracted_features": ext_feat, "phi": phi,
-                        "ind_1": ind_1, "ind_2": ind_2}
-            args_0 = {"E_g1": lambda v: E_g1(gamma_0, gamma_0_x, v,
-                                             gamma_1, gamma_1_x, beta_1),
-                      "group": 0}
-            beta_0_prev = beta_0.copy()
+                        "ind_1": ind_1}
             copt_max_iter = 1
-            beta_0 = copt.minimize_proximal_gradient(
-                fun=F_func.R_func, x0=beta_init[0], prox=prox,
-                max_iter=copt_max_iter,
-                args=[{**args_all, **args_0}], jac=F_func.grad_R,
-                step=lambda x: 2e-3,
-                accelerated=self.copt_accelerate).x.reshape(-1, 1)
-
-            # beta_1 update
-            args_1 = {"E_g1": lambda v: E_g1(gamma_0, gamma_0_x, beta_0_prev,
-                                             gamma_1, gamma_1_x, v),
-                      "group": 1}
-            beta_1 = copt.minimize_proximal_gradient(
-                fun=F_func.R_func, x0=beta_init[1], prox=prox,
-                max_iter=copt_max_iter,
-                args=[{**args_all, **args_1}], jac=F_func.grad_R,
-                step=lambda x: 2e-3,
-                accelerated=self.copt_accelerate).x.reshape(-1, 1)
-
-            # gamma_0 update
+
+            def update_beta(k):
+                args_k = {"E_g1": E_funcs(params, 3 * k + 2)["E_g1"],
+                          "group": k}
+                return copt.minimize_proximal_gradient(
+                    fun=F_func.R_func_and_grad, x0=beta_init[k], prox=prox,
+                    max_iter=copt_max_iter,
+                    args=[{**args_all, **args_k}], jac=True,
+                    step="backtracking",
+                    accelerated=self.copt_accelerate).x.reshape(-1, 1)
+
+            beta_0, beta_1 = parallel(delayed(update_beta)(k)
+                                      for k in range(K))
+
+            # gamma update
             beta_K = [beta_0, beta_1]
+            params[2], params[5] = beta_0, beta_1
             gamma = [gamma_0, gamma_1]
             gamma_x = [gamma_0_x, gamma_1_x]
             groups = np.arange(0, len(gamma_0)).reshape(L, -1).tolist()
@@ -735,82 +883,38 @@ class QNMCEM(Learner):
             prox = SparseGroupL1(l_pen_SGL_gamma, eta_sp_gp_l1, groups).prox
             args_all = {"pi_est": pi_est_K, "E_g5": E_g5,
                         "phi": phi, "beta": beta_K,
-                        "baseline_hazard": baseline_hazard,
+                        "baseline_ind_2": baseline_ind_2,
                         "extracted_features": ext_feat,
-                        "ind_1": ind_1, "ind_2": ind_2,
+                        "ind_1": ind_1,
                         "gamma": gamma,
                         "gamma_x": gamma_x}
-            args_0_x = {"E_g1": lambda v: E_g1(gamma_0, v, beta_0,
-                                               gamma_1, gamma_1_x, beta_1),
-                        "E_log_g1": lambda v: E_log_g1(gamma_0, v, beta_0,
-                                                       gamma_1, gamma_1_x, beta_1),
-                        "E_g6": lambda v: E_g6(gamma_0, v, beta_0,
-                                               gamma_1, gamma_1_x, beta_1),
-                        "group": 0}
-            gamma_0_prev = gamma_0.copy()
-            gamma_0_x_prev = gamma_0_x.copy()
-            # time independence part
-            gamma_0_x_ext = fmin_l_bfgs_b(
-                func=lambda gamma_0_x_ext_: F_func.Q_x_pen_func(
-                    gamma_0_x_ext_, *[{**args_all, **args_0_x}]),
-                x0=gamma_x_init[0],
-                fprime=lambda gamma_0_x_ext_: F_func.grad_Q_x_pen(
-                    gamma_0_x_ext_, *[{**args_all, **args_0_x}]),
-                disp=False, bounds=bounds_gamma_time_indep, maxiter=maxiter,
-                pgtol=pgtol)[0]
-            gamma_0_x = get_vect_from_ext(gamma_0_x_ext).reshape(-1, 1)
-
-            # time dependence part
-            args_0 = {"E_g1": lambda v: E_g1(v, gamma_0_x, beta_0,
-                                             gamma_1, gamma_1_x, beta_1),
-                      "E_log_g1": lambda v: E_log_g1(v, gamma_0_x, beta_0,
-                                                     gamma_1, gamma_1_x,
-                                                     beta_1),
-                      "E_g6": lambda v: E_g6(v, gamma_0_x, beta_0,
-                                             gamma_1, gamma_1_x, beta_1),
-                      "group": 0}
-            gamma_0 = copt.minimize_proximal_gradient(
-                fun=F_func.Q_func, x0=gamma_init[0], prox=prox,
-                max_iter=copt_max_iter,
-                args=[{**args_all, **args_0}], jac=F_func.grad_Q,
-                step=lambda x: 2e-3,
-                accelerated=self.copt_accelerate).x.reshape(-1, 1)
-
-            # gamma_1 update
-            gamma_1_x_prev = gamma_1_x.copy()
-            args_1_x = {"E_g1": lambda v: E_g1(gamma_0_prev, gamma_0_x_prev,
-                                               beta_0, gamma_1, v, beta_1),
-                      "E_log_g1": lambda v: E_log_g1(gamma_0_prev, gamma_0_x_prev,
-                                               beta_0, gamma_1, v, beta_1),
-                      "E_g6": lambda v: E_g6(gamma_0_prev, gamma_0_x_prev,
-                                               beta_0, gamma_1, v, beta_1),
-                      "group": 1}
-            # time independence part
-            gamma_1_x_ext = fmin_l_bfgs_b(
-                func=lambda gamma_1_x_ext_: F_func.Q_x_pen_func(
-                    gamma_1_x_ext_, *[{**args_all, **args_1_x}]),
-                x0=gamma_x_init[1],
-                fprime=lambda gamma_1_indep_ext_: F_func.grad_Q_x_pen(
-                    gamma_1_indep_ext_, *[{**args_all, **args_1_x}]),
-                disp=False, bounds=bounds_gamma_time_indep, maxiter=maxiter,
-                pgtol=pgtol)[
-                0]
-            gamma_1_x = get_vect_from_ext(gamma_1_x_ext).reshape(-1, 1)
-
-            # time dependence part
-            args_1 = {"E_g1": lambda v: E_g1(gamma_0_prev, gamma_0_x_prev,
-                                               beta_0, v, gamma_1_x, beta_1),
-                      "E_log_g1": lambda v: E_log_g1(gamma_0_prev, gamma_0_x_prev,
-                                               beta_0, v, gamma_1_x, beta_1),
-                      "E_g6": lambda v: E_g6(gamma_0_prev, gamma_0_x_prev,
-                                               beta_0, v, gamma_1_x, beta_1),
-                      "group": 1}
-            gamma_1 = copt.minimize_proximal_gradient(
-                fun=F_func.Q_func, x0=gamma_init[1], prox=prox,
-                max_iter=copt_max_iter,
-                args=[{**args_all, **args_1}], jac=F_func.grad_Q,
-                step=lambda x: 2e-3,
-                accelerated=self.copt_accelerate).x.reshape(-1, 1)
+
+            def update_gamma(k):
+                params_k = list(params)
+                # time independence part
+                args_k_x = {**args_all, **E_funcs(params_k, 3 * k + 1),
+                            "group": k}
+                gamma_k_x_ext = minimize(
+                    fun=lambda gamma_k_x_ext_: F_func.Q_x_pen_func_and_grad(
+                        gamma_k_x_ext_, args_k_x),
+                    x0=gamma_x_init[k], jac=True, method='L-BFGS-B',
+                    bounds=bounds_gamma_time_indep, options=lbfgs_options).x
+                gamma_k_x = get_vect_from_ext(gamma_k_x_ext).reshape(-1, 1)
+
+                # time dependence part
+                params_k[3 * k + 1] = gamma_k_x
+                args_k = {**args_all, **E_funcs(params_k, 3 * k),
+                          "group": k}
+                gamma_k = copt.minimize_proximal_gradient(
+                    fun=F_func.Q_func_and_grad, x0=gamma_init[k], prox=prox,
+                    max_iter=copt_max_iter, args=[args_k], jac=True,
+                    step="backtracking",
+                    accelerated=self.copt_accelerate).x.reshape(-1, 1)
+                return gamma_k_x_ext, gamma_k_x, gamma_k
+
+            (gamma_0_x_ext, gamma_0_x, gamma_0), \
+                (gamma_1_x_ext, gamma_1_x, gamma_1) = parallel(
+                    delayed(update_gamma)(k) for k in range(K))
 
             # beta, gamma needs to be updated before the baseline
             self._update_theta(beta_0=beta_0, beta_1=beta_1,
@@ -823,9 +927,8 @@ class QNMCEM(Learner):
 
             # baseline hazard update
             baseline_hazard = pd.Series(
-                data=((((ind_1 * 1).T * delta).sum(axis=1)) /
-                      ((E_g1.T * (ind_2 * 1).T).swapaxes(0, 1) * pi_est_K)
-                      .sum(axis=2).sum(axis=1)), index=T_u)
+                data=delta.dot(ind_1) / np.einsum('ijk,ij,ki->j', E_g1, ind_2,
+                                                  pi_est_K), index=T_u)
 
             # phi update
             beta_stack = np.hstack((beta_0, beta_1))
@@ -837,7 +940,7 @@ class QNMCEM(Learner):
                 pi_est_stack = np.vstack((1 - pi_est_, pi_est_)).T  # K = 2
                 N_l, y_l, U_l, V_l = sum(N_L[l]), y_L[l], U_L[l], V_L[l]
                 beta_l = beta_stack[q_l * l: q_l * (l + 1)]
-                E_g5_l = E_g5.reshape(n_samples, L, q_l)[:, l].reshape(-1, 1)
+                E_g5_l = E_g5.reshape(n_samples, L, r_l)[:, l].reshape(-1, 1)
                 E_g4_l = block_diag(E_g4[:, r_l * l: r_l * (l + 1),
                                     r_l * l: r_l * (l + 1)])
                 tmp = y_l - U_l.dot(beta_l)
@@ -851,7 +954,12 @@ class QNMCEM(Learner):
             pi_xi = self._get_proba(X)
             E_func.theta = self.theta
             S = E_func.construct_MC_samples(N)
-            f = self.f_data_given_latent(X, ext_feat, T, T_u, delta, S, self.MC_sep)
+            # g1 at the new iterate is then cached for the first evaluations
+            # of the next M-step
+            log_f = self.f_data_given_latent(X, ext_feat, T, T_u, delta, S,
+                                             self.MC_sep, log=True,
+                                             E_func=E_func)
+            f = self._rescale_density(log_f)
 
             rel_theta = self._rel_theta(self.theta, prev_theta, 1e-2)
             rel_theta_list.pop(0)
@@ -860,10 +968,8 @@ class QNMCEM(Learner):
             if n_iter % print_every == 0:
                 if self.compute_obj:
                     prev_obj = obj
-                    f_mean = f.mean(axis=-1)
-                    if self.MC_sep:
-                        f_mean *= self.mlmm_density(ext_feat)
-                    obj = self._func_obj(pi_xi, f_mean)
+                    obj = self._func_obj(pi_xi,
+                                         self._log_f_mean(log_f, ext_feat))
                     rel_obj = abs(obj - prev_obj) / abs(prev_obj)
                     self.history.update(n_iter=n_iter, theta=self.theta,
                                         obj=obj, rel_obj=rel_obj)
@@ -881,9 +987,9 @@ class QNMCEM(Learner):
 
         self._end_solve()
 
-    def score(self, X, Y, T, delta):
-        """Computes the C-index score with the trained parameters on the given
-        data
+    def score(self, X, Y, T, delta, metric='C-index'):
+        """Computes the score with the trained parameters on the given data,
+        either the C-index of the marker rule or the log-likelihood
 
         Parameters
         ----------
@@ -892,7 +998,7 @@ class QNMCEM(Learner):
 
         Y : `pandas.DataFrame`, shape=(n_samples, n_long_features)
             The longitudinal data. Each element of the dataframe is
-            a pandas.Series
+            a pandas.Series. A `list` of `LongData` is accepted as well
 
         T : `np.ndarray`, shape=(n_samples,)
             Censored times of the event of interest
@@ -900,12 +1006,26 @@ class QNMCEM(Learner):
         delta : `np.ndarray`, shape=(n_samples,)
             Censoring indicator
 
+        metric : 'log_lik', 'C-index', default='C-index'
+            Either computes log-likelihood or C-index
+
         Returns
         -------
         output : `float`
-            The C-index score computed on the given data
+            The score computed on the given data
         """
         if self._fitted:
-            return c_index_score(T, self.predict_marker(X, Y), delta)
+            if metric == 'C-index':
+                return c_index(self.predict_marker(X, Y), T, delta)
+            elif metric == 'log_lik':
+                ext_feat = extract_features(Y, self.fixed_effect_time_order)
+                log_f = self.f_data_given_latent(X, ext_feat, T, self.T_u,
+                                                 delta, self.S, self.MC_sep,
+                                                 log=True)
+                return self._log_lik(self._get_proba(X),
+                                     self._log_f_mean(log_f, ext_feat))
+            else:
+                raise ValueError("``metric`` must be either 'log_lik' or "
+                                 "'C-index'")
         else:
             raise ValueError('You must fit the model first')
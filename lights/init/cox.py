@@ -29,9 +29,12 @@ def initialize_asso_params(X, T, delta):
     n_time_indep_features = X.shape[1]
     X_columns = ['X' + str(j + 1) for j in range(n_time_indep_features)]
     survival_labels = ['T', 'delta']
-    data = pd.DataFrame(data=np.hstack((X, T.reshape(-1, 1),
-                                        delta.reshape(-1, 1))),
-                        columns=X_columns + survival_labels)
+    # the columns are written in a single buffer, wrapped without copy
+    data = np.empty((X.shape[0], n_time_indep_features + 2))
+    data[:, :n_time_indep_features] = X
+    data[:, -2], data[:, -1] = T, delta
+    data = pd.DataFrame(data=data, columns=X_columns + survival_labels,
+                        copy=False)
 
     cox = CoxPHFitter()
     cox.fit(data, duration_col='T', event_col='delta')
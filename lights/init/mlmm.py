@@ -68,15 +68,15 @@ class MLMM(Learner):
             The value of the log-likelihood
         """
         (U_list, V_list, y_list, N), (U_L, V_L, y_L, N_L) = extracted_features
-        n_samples, n_long_features = len(U_list), len(U_L)
+        n_samples = len(U_list)
         D, beta, phi = self.long_cov, self.fixed_effect_coeffs, self.phi
 
         log_lik = 0
         for i in range(n_samples):
             U_i, V_i, y_i, n_i = U_list[i], V_list[i], y_list[i], sum(N[i])
-            inv_Phi_i = [[phi[l, 0]] * N[i][l] for l in range(n_long_features)]
-            inv_Sigma_i = np.diag(np.concatenate(inv_Phi_i))
-            tmp_1 = multi_dot([V_i, D, V_i.T]) + inv_Sigma_i
+            tmp_1 = multi_dot([V_i, D, V_i.T])
+            # add inv_Sigma_i on the diagonal
+            tmp_1.flat[::n_i + 1] += np.repeat(phi[:, 0], N[i])
             tmp_2 = y_i - U_i.dot(beta)
 
             op1 = n_i * np.log(2 * np.pi)
@@ -164,23 +164,20 @@ class MLMM(Learner):
             Omega_L = [np.zeros(
                 (n_samples * r_l, n_samples * r_l))] * n_long_features
 
+            D_inv = np.linalg.inv(D)
             for i in range(n_samples):
                 U_i, V_i, y_i, N_i = U_list[i], V_list[i], y_list[i], N[i]
 
-                # compute Sigma_i
-                Phi_i = [[1 / phi[l, 0]] * N_i[l]
-                         for l in range(n_long_features)]
-                Sigma_i = np.diag(np.concatenate(Phi_i))
+                # compute the diagonal of Sigma_i, applied as row weights
+                Phi_i = np.repeat(1 / phi[:, 0], N_i)
+                V_i_Sigma_i = V_i.T * Phi_i
 
                 # compute Omega_i
-                D_inv = np.linalg.inv(D)
-                Omega_i = np.linalg.inv(
-                    V_i.transpose().dot(Sigma_i).dot(V_i) + D_inv)
+                Omega_i = np.linalg.inv(V_i_Sigma_i.dot(V_i) + D_inv)
                 Omega.append(Omega_i)
 
                 # compute mu_i
-                mu_i = Omega_i.dot(V_i.transpose()).dot(Sigma_i).dot(
-                    y_i - U_i.dot(beta))
+                mu_i = Omega_i.dot(V_i_Sigma_i).dot(y_i - U_i.dot(beta))
                 mu[:, i] = mu_i.flatten()
 
                 for l in range(n_long_features):
@@ -1,7 +1,9 @@
 from lights.base.base import Learner
 import numpy as np
-import statsmodels.formula.api as smf
-import pandas as pd
+from joblib import Parallel, delayed
+from scipy.optimize import minimize
+from statsmodels.regression.mixed_linear_model import MixedLM
+from lights.model.kernels import ulmm_stats, ulmm_gls, ulmm_reml_and_grad
 
 
 class ULMM(Learner):
@@ -22,12 +24,23 @@ class ULMM(Learner):
         the time-varying features corresponding to the fixed effect. The
         dimension of the corresponding design matrix is then equal to
         fixed_effect_time_order + 1
+
+    n_jobs : `int`, default=1
+        Number of processes used to fit the longitudinal features in parallel
+
+    backend : `str`, default='statsmodels'
+        Solver of the univariate models, either 'statsmodels' for
+        statsmodels' MixedLM or 'numba' for a restricted maximum likelihood
+        fit on compiled per-subject sufficient statistics
     """
 
-    def __init__(self, verbose=True, print_every=10, fixed_effect_time_order=5):
+    def __init__(self, verbose=True, print_every=10, fixed_effect_time_order=5,
+                 n_jobs=1, backend='statsmodels'):
         Learner.__init__(self, verbose=verbose, print_every=print_every)
         self.fixed_effect_time_order = fixed_effect_time_order
         self.verbose = verbose
+        self.n_jobs = n_jobs
+        self.backend = backend
 
         # Attributes that will be instantiated afterwards
         self.fixed_effect_coeffs = None
@@ -49,8 +62,8 @@ class ULMM(Learner):
         fixed_effect_time_order = self.fixed_effect_time_order
         q_l = fixed_effect_time_order + 1
         r_l = 2  # Affine random effects
-        (U_list, V_list, y_list, N), (U_L, V_L, y_L, N_L) = extracted_features
-        n_samples, n_long_features = len(U_list), len(U_L)
+        (U_L, V_L, y_L, N_L) = extracted_features[1]
+        n_long_features = len(U_L)
 
         # Fixed initialization
         q = q_l * n_long_features
@@ -59,35 +72,122 @@ class ULMM(Learner):
         D = np.diag(np.ones(r))
         phi = np.ones((n_long_features, 1))
 
-        for l in range(n_long_features):
-            U = U_L[l][:, 1:]
-            V = U_L[l][:, 1:r_l]
-            Y = y_L[l]
-            S = np.array([])
-            for i in range(n_samples):
-                S = np.append(S, i * np.ones(N_L[l][i]))
-
-            fixed_effect_columns = []
-            other_columns = ['V', 'Y', 'S']
-            for j in range(fixed_effect_time_order):
-                fixed_effect_columns.append('U' + str(j + 1))
-            data = pd.DataFrame(data=np.hstack((U, V, Y, S.reshape(-1, 1))),
-                                columns=fixed_effect_columns + other_columns)
-
-            md = smf.mixedlm("Y ~ " + ' + '.join(fixed_effect_columns), data,
-                             groups=data["S"], re_formula="~V")
-            mdf = md.fit(method='lbfgs', factr=1e15)
-            beta[q_l * l] = mdf.params["Intercept"]
-            beta[q_l * l + 1: q_l * (l + 1)] = [mdf.params[features]
-                                                for features in
-                                                fixed_effect_columns]
-
-            D[r_l * l: r_l * (l + 1), r_l * l: r_l * (l + 1)] = np.array(
-                [[mdf.params["Group Var"], mdf.params["Group x V Cov"]],
-                 [mdf.params["Group x V Cov"], mdf.params["V Var"]]])
-            phi[l] = mdf.resid.values.var()
+        if self.backend == 'statsmodels':
+            fit_one_feature = _fit_one_feature
+        elif self.backend == 'numba':
+            fit_one_feature = _fit_one_feature_numba
+        else:
+            raise ValueError("``backend`` must be either 'statsmodels' or "
+                             "'numba'")
+
+        # Features are independent, hence fitted in parallel
+        results = Parallel(n_jobs=self.n_jobs, prefer='processes')(
+            delayed(fit_one_feature)(U_L[l], y_L[l], N_L[l])
+            for l in range(n_long_features))
+        for l, (beta_l, D_l, phi_l) in enumerate(results):
+            beta[q_l * l: q_l * (l + 1), 0] = beta_l
+            D[r_l * l: r_l * (l + 1), r_l * l: r_l * (l + 1)] = D_l
+            phi[l] = phi_l
 
         self.fixed_effect_coeffs = beta.reshape(-1, 1)
         self.long_cov = D
         self.phi = phi.reshape(-1, 1)
         self._end_solve()
+
+
+def _fit_one_feature(U_l, y_l, N_l):
+    """Fits the univariate linear mixed model of a single longitudinal feature
+
+    Parameters
+    ----------
+    U_l : `np.ndarray`, shape=(N_l, q_l)
+        The fixed-effect design features of the feature for all subjects
+
+    y_l : `np.ndarray`, shape=(N_l, 1)
+        The outcomes of the feature for all subjects
+
+    N_l : `list` of n_samples `int`
+        The number of measurements of the feature for each subject
+
+    Returns
+    -------
+    beta_l : `np.ndarray`, shape=(q_l,)
+        The fixed effect coefficients
+
+    D_l : `np.ndarray`, shape=(r_l, r_l)
+        The covariance matrix of the random effects
+
+    phi_l : `float`
+        The variance of the residuals
+    """
+    r_l = 2  # Affine random effects
+    # Subject of each measurement
+    S = np.repeat(np.arange(len(N_l)), N_l)
+
+    # The design matrices already hold the intercept column
+    md = MixedLM(endog=y_l.flatten(), exog=U_l, groups=S,
+                 exog_re=U_l[:, :r_l])
+    mdf = md.fit(method='lbfgs', factr=1e15)
+    beta_l = np.asarray(mdf.fe_params)
+    D_l = np.asarray(mdf.cov_re_unscaled)
+    phi_l = np.asarray(mdf.resid).var()
+    return beta_l, D_l, phi_l
+
+
+def _fit_one_feature_numba(U_l, y_l, N_l):
+    """Fits the univariate linear mixed model of a single longitudinal feature
+    by restricted maximum likelihood, the variance components being optimized
+    with L-BFGS-B on the per-subject sufficient statistics
+
+    Parameters
+    ----------
+    U_l : `np.ndarray`, shape=(N_l, q_l)
+        The fixed-effect design features of the feature for all subjects
+
+    y_l : `np.ndarray`, shape=(N_l, 1)
+        The outcomes of the feature for all subjects
+
+    N_l : `list` of n_samples `int`
+        The number of measurements of the feature for each subject
+
+    Returns
+    -------
+    beta_l : `np.ndarray`, shape=(q_l,)
+        The fixed effect coefficients
+
+    D_l : `np.ndarray`, shape=(r_l, r_l)
+        The covariance matrix of the random effects
+
+    phi_l : `float`
+        The variance of the residuals
+    """
+    r_l = 2  # Affine random effects
+    X, y = np.ascontiguousarray(U_l, dtype=float), y_l.flatten()
+    offsets = np.concatenate(([0], np.cumsum(N_l)))
+    ZtZ, ZtX, Zty = ulmm_stats(X, y, offsets, r_l)
+    XtX, Xty, yty = X.T.dot(X), X.T.dot(y), y.dot(y)
+
+    # The relative covariance of the random effects is parametrized by the
+    # lower triangle of its Cholesky factor
+    tril = np.tril_indices(r_l)
+
+    def get_L(params):
+        L = np.zeros((r_l, r_l))
+        L[tril] = params
+        return L
+
+    def func_and_grad(params):
+        obj, grad = ulmm_reml_and_grad(get_L(params), ZtZ, ZtX, Zty, XtX,
+                                       Xty, yty, len(y))
+        return obj, grad[tril]
+
+    params = minimize(func_and_grad, np.eye(r_l)[tril], jac=True,
+                      method='L-BFGS-B').x
+    L = get_L(params)
+    _, XtVX, XtVy, _, W = ulmm_gls(L, ZtZ, ZtX, Zty, XtX, Xty, yty)
+    beta_l = np.linalg.solve(XtVX, XtVy)
+    # Residuals given the predicted random effects
+    b = np.einsum('ist,it->is', W, Zty - ZtX.dot(beta_l))
+    S = np.repeat(np.arange(len(N_l)), N_l)
+    resid = y - X.dot(beta_l) - np.einsum('ks,ks->k', X[:, :r_l], b[S])
+    return beta_l, L.dot(L.T), resid.var()
@@ -1,5 +1,4 @@
 import numpy as np
-from lights.base.base import block_diag
 
 
 class AssociationFunctions:
@@ -31,11 +30,12 @@ class AssociationFunctions:
         J = self.J
 
         # U, integral over U, derivative of U
-        U_l, iU_l, dU_l = np.ones(J), T_u, np.zeros(J)
-        for t in range(1, self.q_l):
-            U_l = np.c_[U_l, T_u ** t]
-            iU_l = np.c_[iU_l, (T_u ** (t + 1)) / (t + 1)]
-            dU_l = np.c_[dU_l, t * T_u ** (t - 1)]
+        t = np.arange(q_l)
+        powers = np.power.outer(T_u, np.arange(q_l + 1))
+        U_l = powers[:, :-1]
+        iU_l = powers[:, 1:] / (t + 1)
+        dU_l = np.zeros((J, q_l))
+        dU_l[:, 1:] = t[1:] * powers[:, :-2]
 
         V_l = np.c_[np.ones(J), T_u]
         iV_l = np.c_[T_u, (T_u ** 2) / 2]
@@ -63,22 +63,24 @@ class AssociationFunctions:
         rand_feat : `np.ndarray`, shape=(J, A*r, r)
             Feature corresponding to random effects
         """
-        L = self.n_long_features
+        L, J = self.n_long_features, self.J
         q_l, r_l = self.q_l, 2
-        r, q = L * r_l, L * q_l
-        J = self.J
         asso_functions = self.asso_functions
-        nb_asso_param = len(asso_functions)
-        if 're' in asso_functions:
-            nb_asso_param += 1
-        fixed_feat = np.zeros(shape=(J, nb_asso_param * L, q))
-        rand_feat = np.zeros(shape=(J, nb_asso_param * L, r))
-        for j in range(J):
-            tmp_U = np.array([]).reshape(0, q_l)
-            tmp_V = np.array([]).reshape(0, r_l)
-            for asso_function in asso_functions:
-                tmp_U = np.vstack((tmp_U, self.fixed_feat[asso_function][j]))
-                tmp_V = np.vstack((tmp_V, self.fixed_feat[asso_function][j]))
-            fixed_feat[j] = block_diag((tmp_U,) * L)
-            rand_feat[j] = block_diag((tmp_V,) * L)
+        fixed = [np.reshape(self.fixed_feat[asso_function], (J, -1, q_l))
+                 for asso_function in asso_functions]
+        rand = [np.reshape(self.rand_feat[asso_function], (J, -1, r_l))
+                for asso_function in asso_functions]
+        # Block diagonal over the L longitudinal features, each association
+        # function written once at its offset
+        nb_asso_param = sum(feat.shape[1] for feat in fixed)
+        fixed_feat = np.zeros((J, L, nb_asso_param, L, q_l))
+        rand_feat = np.zeros((J, L, nb_asso_param, L, r_l))
+        idx, offset = np.arange(L), 0
+        for U, V in zip(fixed, rand):
+            d = U.shape[1]
+            fixed_feat[:, idx, offset:offset + d, idx] = U
+            rand_feat[:, idx, offset:offset + d, idx] = V
+            offset += d
+        fixed_feat = fixed_feat.reshape(J, L * nb_asso_param, L * q_l)
+        rand_feat = rand_feat.reshape(J, L * nb_asso_param, L * r_l)
         return fixed_feat, rand_feat
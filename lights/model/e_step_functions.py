@@ -47,10 +47,20 @@ class EstepFunctions:
     MC_sep: `bool`, default=False
         If `False`, we use the same set of MC samples for all subject,
         otherwise we sample a seperate set of MC samples for each subject
+
+    asso_feat : `tuple`, default=None
+        The stacked association features for fixed and random effects, as
+        returned by `AssociationFunctions.get_asso_feat`. Computed if `None`
+
+    dtype : `np.dtype`, default=np.float64
+        Floating point type of the Monte Carlo tensors g1 and g2. With
+        `np.float32` their memory traffic is halved, but the exponential in
+        g1 overflows for linear predictors above ~88
     """
 
     def __init__(self, X, T, T_u, delta, extracted_features,
-                 fixed_effect_time_order, asso_functions, theta, MC_sep):
+                 fixed_effect_time_order, asso_functions, theta, MC_sep, *,
+                 asso_feat=None, dtype=np.float64):
         self.K = 2  # 2 latent groups
         self.X, self.T, self.delta = X, T, delta
         self.T_u, self.n_samples = T_u, len(T)
@@ -61,10 +71,14 @@ class EstepFunctions:
         self.fixed_effect_time_order = fixed_effect_time_order
         self.asso_functions = asso_functions
         alpha, L = self.fixed_effect_time_order, self.n_long_features
-        self.F_f, self.F_r = AssociationFunctions(asso_functions, T_u,
-                                        alpha, L).get_asso_feat()
+        if asso_feat is None:
+            asso_feat = AssociationFunctions(asso_functions, T_u,
+                                             alpha, L).get_asso_feat()
+        self.F_f, self.F_r = asso_feat
         self.MC_sep = MC_sep
-        self.g3_, self.g4_, self.g9_ = None, None, None
+        self.dtype = dtype
+        # Last point g1 was evaluated at, along with its logarithm and value
+        self._g1_cache = None
 
     def construct_MC_samples(self, N_MC):
         """Constructs the set of samples used for Monte Carlo approximation
@@ -87,27 +101,24 @@ class EstepFunctions:
         if self.MC_sep:
             n_samples = self.n_samples
             (U, V, y, N) = self.extracted_features[0]
-            n_long_features = self.n_long_features
             phi = self.theta["phi"]
             beta = np.hstack((self.theta["beta_0"], self.theta["beta_1"]))
             r = D.shape[0]
             Omega = np.random.multivariate_normal(np.zeros(r), np.eye(r), N_MC)
             S = np.zeros((n_samples, 2, 2 * N_MC, r))
+            D_inv = np.linalg.inv(D)
 
             for i in range(n_samples):
                 U_i, V_i, y_i, N_i = U[i], V[i], y[i], N[i]
 
-                # compute Sigma_i
-                Phi_i = [[1 / phi[l, 0]] * N_i[l]
-                         for l in range(n_long_features)]
-                Sigma_i = np.diag(np.concatenate(Phi_i))
+                # compute the diagonal of Sigma_i, applied as row weights
+                Phi_i = np.repeat(1 / phi[:, 0], N_i)
+                V_i_Sigma_i = V_i.T * Phi_i
 
                 # compute Omega_i
-                D_inv = np.linalg.inv(D)
-                A_i = np.linalg.inv(
-                    V_i.transpose().dot(Sigma_i).dot(V_i) + D_inv)
+                A_i = np.linalg.inv(V_i_Sigma_i.dot(V_i) + D_inv)
                 # compute mu_i
-                mu_i = (A_i.dot(V_i.transpose()).dot(Sigma_i).dot(
+                mu_i = (A_i.dot(V_i_Sigma_i).dot(
                     y_i - U_i.dot(beta))).T[..., np.newaxis]
                 C_i = np.linalg.cholesky(A_i)
                 tmp = C_i.dot(Omega.T)
@@ -122,7 +133,7 @@ class EstepFunctions:
         return S
 
     def g1(self, S, gamma_0, gamma_0_x, beta_0,
-           gamma_1, gamma_1_x, beta_1, broadcast=True):
+           gamma_1, gamma_1_x, beta_1, broadcast=True, log=False):
         """Computes g1
 
         Parameters
@@ -151,6 +162,10 @@ class EstepFunctions:
         broadcast : `boolean`, default=True
             Indicates to expand the dimension of g1 or not
 
+        log : `boolean`, default=False
+            If `True`, the logarithm of g1 is computed instead, without going
+            through its exponential
+
         Returns
         -------
         g1 : `np.ndarray`, shape=(n_samples, K, N_MC, J)
@@ -158,17 +173,34 @@ class EstepFunctions:
             The values of g1 function
         """
         n_samples, K = self.n_samples, self.K
-        p = self.n_time_indep_features
-        X, T_u, J = self.X, self.T_u, self.J
-        if self.MC_sep:
-            g2 = self.g2(S, gamma_0, beta_0, gamma_1, beta_1)
+        X, J = self.X, self.J
+        # E_g1, E_log_g1 and E_g6 are evaluated at the same point in the
+        # M-step, hence g2 is only computed once per point
+        params = (S, gamma_0, gamma_0_x, beta_0, gamma_1, gamma_1_x, beta_1)
+        key = tuple(np.asarray(v).tobytes() for v in params)
+        cache = self._g1_cache
+        if cache is not None and cache[0] == key:
+            _, tmp, g2, log_g1, g1 = cache
         else:
-            N_MC = S.shape[0]
-            g2 = self.g2(S, gamma_0, beta_0, gamma_1, beta_1)\
-                .reshape(K, 1, J, N_MC)
-        gamma_x = np.hstack((gamma_0_x, gamma_1_x))
-        tmp = X.dot(gamma_x).T.reshape(K, n_samples, 1, 1)
-        g1 = np.exp(tmp + g2).swapaxes(0, 1).swapaxes(2, 3)
+            if self.MC_sep:
+                g2 = self.g2(S, gamma_0, beta_0, gamma_1, beta_1)
+            else:
+                N_MC = S.shape[0]
+                g2 = self.g2(S, gamma_0, beta_0, gamma_1, beta_1)\
+                    .reshape(K, 1, J, N_MC)
+            gamma_x = np.hstack((gamma_0_x, gamma_1_x))
+            tmp = X.dot(gamma_x).T.reshape(K, n_samples, 1, 1)\
+                .astype(self.dtype, copy=False)
+            log_g1, g1 = None, None
+        if log and log_g1 is None:
+            log_g1 = (tmp + g2).transpose(1, 0, 3, 2)
+        if not log and g1 is None:
+            # exp(tmp + g2) = exp(tmp) * exp(g2), the time-independent part
+            # being only exponentiated once per subject and group
+            g1 = (np.exp(tmp) * np.exp(g2)).transpose(1, 0, 3, 2)
+        self._g1_cache = (key, tmp, g2, log_g1, g1)
+        if log:
+            g1 = log_g1
         if broadcast:
             g1 = np.broadcast_to(g1[..., None], g1.shape + (2,)).swapaxes(1, -1)
         return g1
@@ -198,20 +230,21 @@ class EstepFunctions:
         g2 : `np.ndarray`, shape=(K, J, N_MC) or (K, n_samples, J, N_MC)
             The values of g2 function
         """
-        T_u, p, K = self.T_u, self.n_time_indep_features, self.K
         gamma = np.hstack((gamma_0, gamma_1)).T
-        beta = np.hstack((beta_0, beta_1)).T
-        F_f, F_r = self.F_f, self.F_r
+        beta = np.hstack((beta_0, beta_1))
+        # gamma is contracted first, leaving (K, J) and (K, J, r) arrays to be
+        # multiplied by the Monte Carlo samples
+        dtype = self.dtype
+        asso_f = np.einsum('jak,ka->kj', self.F_f.dot(beta), gamma)\
+            .astype(dtype, copy=False)
+        asso_r = np.einsum('jas,ka->kjs', self.F_r, gamma)\
+            .astype(dtype, copy=False)
+        S = S.astype(dtype, copy=False)
         if self.MC_sep:
-            g2 = ((F_f.dot(beta.T)[:, :, :, None, None]
-                   + (F_r[:, :, :, None, None, None] * S.T).sum(
-                        axis=2).swapaxes(2, 3))
-                  .swapaxes(2, 3).swapaxes(1, 4) * gamma).sum(axis=-1)
-            g2 = g2.swapaxes(0, 2).swapaxes(1, 2).T
+            g2 = asso_f[:, None, :, None] + np.matmul(
+                asso_r[:, None], S.transpose(1, 0, 3, 2))
         else:
-            g2 = ((F_f.dot(beta.T)[:, :, :, None] + F_r.dot(S.T)[:, :, None, :])
-                  .swapaxes(1, 3) * gamma).sum(axis=-1)
-            g2 = g2.swapaxes(0, 1).T
+            g2 = asso_f[:, :, None] + asso_r.dot(S.T)
         return g2
 
     def g3(self, S, beta_0, beta_1):
@@ -232,15 +265,19 @@ class EstepFunctions:
         U_list, V_list, y_list, N_list = self.extracted_features[0]
         K = self.K
         beta_stack = np.hstack((beta_0, beta_1))
-        g3 = []
-        for i in range(n_samples):
-            U_i, V_i, y_i, n_i = U_list[i], V_list[i], y_list[i], N_list[i]
-            if self.MC_sep:
+        if self.MC_sep:
+            g3 = []
+            for i in range(n_samples):
+                U_i, V_i = U_list[i], V_list[i]
                 M_iS = U_i.dot(beta_stack).T.reshape(K, -1, 1) \
-                       + S[i].dot(V_i.T).swapaxes(1, 2)
-            else:
-                M_iS = U_i.dot(beta_stack).T.reshape(K, -1, 1) + V_i.dot(S.T)
-            g3.append(M_iS)
+                       + np.matmul(S[i], V_i.T).swapaxes(1, 2)
+                g3.append(M_iS)
+        else:
+            # All subjects at once on their stacked measurements, then split
+            U, V = np.concatenate(U_list), np.concatenate(V_list)
+            M_S = U.dot(beta_stack).T[..., np.newaxis] + np.matmul(V, S.T)
+            n_rows = np.cumsum([sum(n_i) for n_i in N_list])
+            g3 = np.split(M_S, n_rows[:-1], axis=1)
         return g3
 
     def g4(self, S):
@@ -256,18 +293,11 @@ class EstepFunctions:
         g4 : `np.ndarray`, shape=(n_samples, K, N_MC, r, r)
             The values of g4 function
         """
+        # outer products of all the samples at once
         if self.MC_sep:
-            n_samples = self.n_samples
-            K, r = self.K, self.n_long_features * 2
-            N_MC = S.shape[2]
-            g4 = np.zeros((n_samples, K, N_MC, r, r))
-            for i in range(n_samples):
-                for k in range(K):
-                    g4[i, k] = np.array(
-                        [s.reshape(-1, 1).dot(s.reshape(-1, 1).T)
-                         for s in S[i, k]])
+            g4 = np.einsum('ikms,ikmt->ikmst', S, S)
         else:
-            tmp = np.array([s.reshape(-1, 1).dot(s.reshape(-1, 1).T) for s in S])
+            tmp = np.einsum('ms,mt->mst', S, S)
             g4 = np.broadcast_to(tmp, (self.n_samples, self.K) + tmp.shape)
         return g4
 
@@ -321,17 +351,17 @@ class EstepFunctions:
         g6 : `np.ndarray`, shape=(n_samples, K, N_MC, r, J, K)
             The values of g6 function
         """
+        K = self.K
+        g1 = self.g1(S, gamma_0, gamma_0_x, beta_0,
+                     gamma_1, gamma_1_x, beta_1, broadcast=False)
+        # the product is computed once, and only broadcast to the duplicated
+        # group axis
         if self.MC_sep:
-            g1 = self.g1(S, gamma_0, gamma_0_x, beta_0,
-                         gamma_1, gamma_1_x, beta_1)
-            g6 = g1.swapaxes(0, -2)[..., np.newaxis] \
-                 * S.swapaxes(0, 2).swapaxes(1, 2)
-            return g6.T.swapaxes(0, 2).swapaxes(2, 3).swapaxes(4, 5)
+            g6 = np.einsum('ikmj,ikms->ikmsj', g1, S)[..., np.newaxis]
+            return np.broadcast_to(g6, g6.shape[:-1] + (K,))
         else:
-            g1 = self.g1(S, gamma_0, gamma_0_x, beta_0,
-                         gamma_1, gamma_1_x, beta_1, broadcast=True)
-            g6 = g1.swapaxes(2, -1)[..., np.newaxis] * S
-            return g6.swapaxes(2, -1).swapaxes(3, 4).swapaxes(2, 3)
+            g6 = np.einsum('ikmj,ms->imsjk', g1, S)[:, np.newaxis]
+            return np.broadcast_to(g6, (g6.shape[0], K) + g6.shape[2:])
 
     @staticmethod
     def Lambda_g(g, f):
@@ -356,7 +386,9 @@ class EstepFunctions:
             all Monte Carlo samples. Each element could be real or matrices
             depending on Im(\tilde{g}_i)
         """
-        Lambda_g = np.mean((g.T * f.T).T, axis=2)
+        # Reduced over the Monte Carlo samples without materializing g, which
+        # is often a broadcast view of S replicated over subjects and groups
+        Lambda_g = np.einsum('ikm,ikm...->ik...', f, g) / g.shape[2]
         return Lambda_g
 
     def Eg(self, g, Lambda_1, pi_xi, f):
@@ -385,7 +417,88 @@ class EstepFunctions:
         Eg : `np.ndarray`, shape=(n_samples, g.shape)
             The approximated expectations for g
         """
-        Lambda_g = self.Lambda_g(g, f)
-        Eg = (Lambda_g[:, 0].T * (1 - pi_xi) + Lambda_g[:, 1].T * pi_xi) / (
-                Lambda_1[:, 0] * (1 - pi_xi) + Lambda_1[:, 1] * pi_xi)
-        return Eg.T
+        Eg = np.einsum('ikm,ikm...->i...',
+                       self._Eg_weights(Lambda_1, pi_xi, f), g)
+        return Eg
+
+    def Eg6(self, S, gamma_0, gamma_0_x, beta_0, gamma_1, gamma_1_x, beta_1,
+            Lambda_1, pi_xi, f):
+        """Computes the approximated expectation of g6, reducing the product of
+        g1 with the Monte Carlo samples without forming g6
+
+        Parameters
+        ----------
+        S : `np.ndarray`, shape=(N_MC, r)
+            Set of constructed Monte Carlo samples
+
+        gamma_0 : `np.ndarray`, shape=(L * nb_asso_param,)
+            Association parameters for low-risk group
+
+        gamma_0_x : `np.ndarray`, shape=(p,)
+            Time-independent feature  parameters for low-risk group
+
+        beta_0 : `np.ndarray`, shape=(q,)
+            Fixed effect parameters for low-risk group
+
+        gamma_1 : `np.ndarray`, shape=(L * nb_asso_param,)
+            Association parameters for high-risk group
+
+        gamma_1_x : `np.ndarray`, shape=(p,)
+            Time-independent feature  parameters for high-risk group
+
+        beta_1 : `np.ndarray`, shape=(q,)
+            Fixed effect parameters for high-risk group
+
+        Lambda_1: `np.ndarray`, shape=(n_samples, K)
+            Approximated integral (see (15) in the lights paper) with
+            \tilde(g)=1
+
+        pi_xi: `np.ndarray`, shape=(n_samples,)
+            The posterior probability of the sample for being on the
+            high-risk group given all observed data
+
+        f: `np.ndarray`, shape=(n_samples, K, N_MC)
+            The value of the f(Y, T, delta| S, G ; theta)
+
+        Returns
+        -------
+        Eg6 : `np.ndarray`, shape=(n_samples, r, J, K)
+            The approximated expectation of g6
+        """
+        g1 = self.g1(S, gamma_0, gamma_0_x, beta_0,
+                     gamma_1, gamma_1_x, beta_1, broadcast=False)
+        W = self._Eg_weights(Lambda_1, pi_xi, f)
+        if self.MC_sep:
+            Eg6 = np.einsum('ikm,ikmj,ikms->isj', W, g1, S,
+                            optimize=True)[..., np.newaxis]
+            return np.broadcast_to(Eg6, Eg6.shape[:-1] + (self.K,))
+        else:
+            return np.einsum('ikm,ilmj,ms->isjl', W, g1, S, optimize=True)
+
+    @staticmethod
+    def _Eg_weights(Lambda_1, pi_xi, f):
+        """Weights of the Monte Carlo samples in the approximated expectations,
+        the mixture over the groups and its normalization being folded into
+        them so that g is reduced in a single pass
+
+        Parameters
+        ----------
+        Lambda_1: `np.ndarray`, shape=(n_samples, K)
+            Approximated integral (see (15) in the lights paper) with
+            \tilde(g)=1
+
+        pi_xi: `np.ndarray`, shape=(n_samples,)
+            The posterior probability of the sample for being on the
+            high-risk group given all observed data
+
+        f: `np.ndarray`, shape=(n_samples, K, N_MC)
+            The value of the f(Y, T, delta| S, G ; theta)
+
+        Returns
+        -------
+        output : `np.ndarray`, shape=(n_samples, K, N_MC)
+            The weights of the Monte Carlo samples
+        """
+        pi_K = np.column_stack((1 - pi_xi, pi_xi))
+        pi_K /= (Lambda_1 * pi_K).sum(axis=1, keepdims=True)
+        return f * pi_K[..., np.newaxis] / f.shape[2]
@@ -0,0 +1,147 @@
+import numpy as np
+from numba import njit, prange
+
+
+@njit(fastmath=True, cache=True)
+def P_and_grad(X, pi_est, xi_0, xi, fit_intercept):
+    """Computes the function P and its gradient with respect to the extension
+    of (xi_0, xi) on positive and negative parts, streaming once over the
+    rows of X
+    """
+    n_samples, p = X.shape
+    dim = p + fit_intercept
+    P = 0.
+    grad = np.zeros(2 * dim)
+    for i in range(n_samples):
+        u = xi_0
+        for j in range(p):
+            u += X[i, j] * xi[j]
+        t = np.exp(-abs(u))
+        # log(1 + exp(-u)) and its derivative -1 / (1 + exp(u))
+        P += pi_est[i] * (max(-u, 0.) + np.log1p(t))
+        if u >= 0:
+            g = -pi_est[i] * t / (1. + t)
+        else:
+            g = -pi_est[i] / (1. + t)
+        if fit_intercept:
+            grad[0] += g
+        for j in range(p):
+            grad[fit_intercept + j] += g * X[i, j]
+    for j in range(dim):
+        grad[j] /= n_samples
+        grad[dim + j] = -grad[j]
+    return P / n_samples, grad
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def grad_R_long(U, V, y, offsets, phi_rep, beta, E_g5, pi_est):
+    """Computes the longitudinal part of the gradient of R, looping over the
+    measurements of each subject stacked row-wise, the rows of subject i
+    being offsets[i]:offsets[i + 1]
+    """
+    n_samples = len(offsets) - 1
+    d, r = U.shape[1], V.shape[1]
+    out = np.zeros((n_samples, d))
+    for i in prange(n_samples):
+        for k in range(offsets[i], offsets[i + 1]):
+            resid = y[k]
+            for j in range(d):
+                resid -= U[k, j] * beta[j]
+            for j in range(r):
+                resid -= V[k, j] * E_g5[i, j]
+            resid *= pi_est[i] / phi_rep[k]
+            for j in range(d):
+                out[i, j] += U[k, j] * resid
+    return out.sum(axis=0)
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def grad_Q_asso(w_1, w_2, E_g1, E_g5, E_g6, F_f_beta, F_r):
+    """Computes the gradient of Q with respect to the time-dependent
+    association parameters, up to the -1 / n_samples factor, looping over
+    subjects and skipping the times where both weights vanish
+    """
+    n_samples, J = w_1.shape
+    A, r = F_r.shape[1], F_r.shape[2]
+    out = np.zeros((n_samples, A))
+    for i in prange(n_samples):
+        for j in range(J):
+            c_1, c_2 = w_1[i, j], w_2[i, j]
+            if c_1 == 0. and c_2 == 0.:
+                continue
+            c_f = c_1 - c_2 * E_g1[i, j]
+            for a in range(A):
+                acc = c_f * F_f_beta[j, a]
+                for s in range(r):
+                    acc += F_r[j, a, s] * (c_1 * E_g5[i, s]
+                                           - c_2 * E_g6[i, s, j])
+                out[i, a] += acc
+    return out.sum(axis=0)
+
+
+@njit(cache=True)
+def ulmm_stats(X, y, offsets, r):
+    """Computes the per-subject sufficient statistics Z_i^T Z_i, Z_i^T X_i
+    and Z_i^T y_i of an univariate linear mixed model, Z being the first r
+    columns of X and the rows of subject i being offsets[i]:offsets[i + 1]
+    """
+    n_samples, q = len(offsets) - 1, X.shape[1]
+    ZtZ = np.zeros((n_samples, r, r))
+    ZtX = np.zeros((n_samples, r, q))
+    Zty = np.zeros((n_samples, r))
+    for i in range(n_samples):
+        for k in range(offsets[i], offsets[i + 1]):
+            for s in range(r):
+                for j in range(q):
+                    ZtX[i, s, j] += X[k, s] * X[k, j]
+                for t in range(r):
+                    ZtZ[i, s, t] += X[k, s] * X[k, t]
+                Zty[i, s] += X[k, s] * y[k]
+    return ZtZ, ZtX, Zty
+
+
+@njit(cache=True)
+def ulmm_gls(L, ZtZ, ZtX, Zty, XtX, Xty, yty):
+    """Computes the generalized least squares quantities of an univariate
+    linear mixed model whose random effects covariance is L L^T relative to
+    the residual variance, inverting I + Z_i L L^T Z_i^T through the
+    Woodbury identity on each subject
+    """
+    n_samples, r = Zty.shape
+    W = np.empty((n_samples, r, r))
+    XtVX, XtVy, ytVy = XtX.copy(), Xty.copy(), yty
+    logdet = 0.
+    for i in range(n_samples):
+        M = np.eye(r) + np.dot(L.T, np.dot(ZtZ[i], L))
+        logdet += np.log(np.linalg.det(M))
+        W[i] = np.dot(L, np.linalg.solve(M, L.T))
+        WZtX = np.dot(W[i], ZtX[i])
+        XtVX -= np.dot(ZtX[i].T, WZtX)
+        XtVy -= np.dot(WZtX.T, Zty[i])
+        ytVy -= np.dot(Zty[i], np.dot(W[i], Zty[i]))
+    return logdet, XtVX, XtVy, ytVy, W
+
+
+@njit(cache=True)
+def ulmm_reml_and_grad(L, ZtZ, ZtX, Zty, XtX, Xty, yty, n_obs):
+    """Computes minus twice the restricted log-likelihood of an univariate
+    linear mixed model, the fixed effects and the residual variance being
+    profiled out, and its gradient with respect to L
+    """
+    logdet, XtVX, XtVy, ytVy, W = ulmm_gls(L, ZtZ, ZtX, Zty, XtX, Xty, yty)
+    n_samples, r = Zty.shape
+    dof = n_obs - XtX.shape[0]
+    A_inv = np.linalg.inv(XtVX)
+    beta = np.dot(A_inv, XtVy)
+    rVr = ytVy - np.dot(beta, XtVy)
+    obj = logdet + np.log(np.linalg.det(XtVX)) + dof * np.log(rVr)
+    # gradient with respect to the relative covariance L L^T
+    G = np.zeros((r, r))
+    for i in range(n_samples):
+        ZtZW = np.dot(ZtZ[i], W[i])
+        Ztr = Zty[i] - np.dot(ZtX[i], beta)
+        c = Ztr - np.dot(ZtZW, Ztr)
+        P = ZtX[i] - np.dot(ZtZW, ZtX[i])
+        G += ZtZ[i] - np.dot(ZtZW, ZtZ[i]) - dof / rVr * np.outer(c, c) \
+            - np.dot(P, np.dot(A_inv, P.T))
+    return obj, 2 * np.dot(G, L)
@@ -1,8 +1,9 @@
 import numpy as np
-from numpy.linalg import multi_dot
-from lights.base.base import logistic_loss, get_xi_from_xi_ext, get_vect_from_ext
+from lights.base.base import logistic_loss, logistic_grad, \
+    get_xi_from_xi_ext, get_vect_from_ext
 from lights.model.regularizations import ElasticNet
 from lights.model.associations import AssociationFunctions
+from lights.model.kernels import P_and_grad, grad_R_long, grad_Q_asso
 
 
 class MstepFunctions:
@@ -38,28 +39,97 @@ class MstepFunctions:
         For eta_elastic_net = 1 this is lasso (L1) regularization
         For 0 < eta_elastic_net < 1, the regularization is a linear combination
         of L1 and L2
+
+    asso_feat : `tuple`, default=None
+        The stacked association features for fixed and random effects, as
+        returned by `AssociationFunctions.get_asso_feat`. Computed if `None`
     """
 
     def __init__(self, fit_intercept, X, T, delta, n_long_features,
                  n_time_indep_features, l_pen_EN, eta_elastic_net,
-                 fixed_effect_time_order, asso_functions):
+                 fixed_effect_time_order, asso_functions, *, asso_feat=None):
         self.fit_intercept = fit_intercept
         self.X, self.T, self.delta = X, T, delta
         self.n_long_features = n_long_features
         self.n_time_indep_features = n_time_indep_features
         n_samples = len(T)
         self.n_samples = n_samples
+        # Design matrix of xi, including the intercept column if needed
+        if fit_intercept:
+            self.X_design = np.column_stack((np.ones(n_samples), X))
+        else:
+            self.X_design = X
+        # Single precision copy streamed by the P kernel, which accumulates
+        # in double precision
+        self.X_single = np.ascontiguousarray(X, dtype=np.float32)
         self.fixed_effect_time_order = fixed_effect_time_order
         self.asso_functions = asso_functions
         self.ENet = ElasticNet(l_pen_EN, eta_elastic_net)
-        T_u = np.unique(self.T)
-        alpha, L = self.fixed_effect_time_order, self.n_long_features
-        self.F_f, self.F_r = AssociationFunctions(asso_functions, T_u,
-                                        alpha, L).get_asso_feat()
+        if asso_feat is None:
+            T_u = np.unique(self.T)
+            alpha, L = self.fixed_effect_time_order, self.n_long_features
+            asso_feat = AssociationFunctions(asso_functions, T_u,
+                                             alpha, L).get_asso_feat()
+        self.F_f, self.F_r = asso_feat
+        self._long_stack = None
+
+    def _get_long_stack(self, extracted_features):
+        """Stacks row-wise the longitudinal measurements of all subjects, only
+        once for given extracted features
+
+        Parameters
+        ----------
+        extracted_features :  `tuple, tuple`,
+            The extracted features from longitudinal data
+
+        Returns
+        -------
+        output : `tuple`
+            The stacked U, V and y, the offsets of the rows of each subject,
+            and the subject and the longitudinal feature of each row
+        """
+        if self._long_stack is None or \
+                self._long_stack[0] is not extracted_features:
+            U_list, V_list, y_list, N_list = extracted_features[0]
+            n_samples, L = self.n_samples, self.n_long_features
+            U, V = np.concatenate(U_list), np.concatenate(V_list)
+            y = np.concatenate(y_list).flatten()
+            N = np.array(N_list)
+            n_rows = N.sum(axis=1)
+            offsets = np.concatenate(([0], n_rows.cumsum()))
+            idx_sample = np.repeat(np.arange(n_samples), n_rows)
+            idx_feat = np.repeat(np.tile(np.arange(L), n_samples), N.flatten())
+            self._long_stack = (extracted_features,
+                                (U, V, y, offsets, idx_sample, idx_feat))
+        return self._long_stack[1]
+
+    @staticmethod
+    def _get_E_g_group(arg, name, param):
+        """Evaluates an expectation of the E-step and restricts it to the
+        latent group of the current update
+
+        Parameters
+        ----------
+        arg : `dict`
+            The arguments of the M-step functions
+
+        name : `str`
+            The key of the expectation in arg, eg. "E_g1"
+
+        param : `np.ndarray`
+            The parameter the expectation is evaluated at
+
+        Returns
+        -------
+        output : `np.ndarray`
+            The expectation on the latent group, as a C-contiguous array with
+            the group axis dropped
+        """
+        return np.ascontiguousarray(arg[name](param)[..., arg["group"]])
 
     def P_pen_func(self, pi_est, xi_ext):
         """Computes the sub objective function P with penalty, to be minimized
-        at each QNMCEM iteration using fmin_l_bfgs_b.
+        at each QNMCEM iteration using L-BFGS-B.
 
         Parameters
         ----------
@@ -101,8 +171,11 @@ class MstepFunctions:
             The value of the P sub objective
         """
         xi_0, xi = get_xi_from_xi_ext(xi_ext, self.fit_intercept)
-        u = xi_0 + self.X.dot(xi)
-        P = (pi_est * logistic_loss(u)).mean()
+        # u is overwritten by the loss, avoiding the temporaries, hence it
+        # must be a float array even for integer inputs
+        u = self.X.dot(xi).astype(np.float64, copy=False)
+        u += xi_0
+        P = pi_est.dot(logistic_loss(u, out=u)) / self.n_samples
         return P
 
     def grad_P(self, pi_est, xi_ext):
@@ -123,18 +196,58 @@ class MstepFunctions:
         output : `np.ndarray`
             The value of the P sub objective gradient
         """
-        fit_intercept = self.fit_intercept
-        X, n_samples = self.X, self.n_samples
-        xi_0, xi = get_xi_from_xi_ext(xi_ext, fit_intercept)
-        u = xi_0 + X.dot(xi)
-        if fit_intercept:
-            X = np.concatenate((np.ones(n_samples).reshape(1, n_samples).T, X),
-                               axis=1)
-        grad = X * (pi_est * np.exp(-logistic_loss(-u))).reshape(-1, 1)
-        grad = - grad.mean(axis=0)
-        grad_sub_obj = np.concatenate([grad, -grad])
+        xi_0, xi = get_xi_from_xi_ext(xi_ext, self.fit_intercept)
+        # u is overwritten by the weights of the samples, hence it must be a
+        # float array even for integer inputs
+        u = self.X.dot(xi).astype(np.float64, copy=False)
+        u += xi_0
+        np.negative(u, out=u)
+        logistic_grad(u, out=u)
+        u *= pi_est
+        dim = self.X_design.shape[1]
+        grad_sub_obj = np.empty(2 * dim)
+        grad_sub_obj[:dim] = -self.X_design.T.dot(u) / self.n_samples
+        np.negative(grad_sub_obj[:dim], out=grad_sub_obj[dim:])
         return grad_sub_obj
 
+    def P_pen_func_and_grad(self, pi_est, xi_ext):
+        """Computes both the sub objective P with penalty and its gradient,
+        with a single pass over the samples
+
+        Parameters
+        ----------
+        pi_est : `np.ndarray`, shape=(n_samples,)
+            The estimated posterior probability of the latent class membership
+            obtained by the E-step
+
+        xi_ext : `np.ndarray`, shape=(2*n_time_indep_features,)
+            The time-independent coefficient vector decomposed on positive and
+            negative parts
+
+        Returns
+        -------
+        sub_obj : `float`
+            The value of the P sub objective to be minimized at each QNMCEM step
+
+        grad_sub_obj : `np.ndarray`
+            The value of the P sub objective gradient
+        """
+        fit_intercept = int(self.fit_intercept)
+        dim = len(xi_ext) // 2
+        xi_0, xi = get_xi_from_xi_ext(xi_ext, fit_intercept)
+        P, grad_sub_obj = P_and_grad(self.X_single, pi_est, xi_0, xi,
+                                     fit_intercept)
+        # ElasticNet penalty and its gradient written in place, the intercept
+        # not being penalized
+        l_pen, eta = self.ENet.l_pen, self.ENet.eta
+        grad_ridge = l_pen * eta * xi
+        grad_lasso = l_pen * (1 - eta)
+        grad_sub_obj[fit_intercept:dim] += grad_ridge + grad_lasso
+        grad_sub_obj[dim + fit_intercept:] += grad_lasso - grad_ridge
+        sub_obj = P + l_pen * ((1. - eta) * abs(xi).sum()
+                               + .5 * eta * np.vdot(xi, xi))
+        return sub_obj, grad_sub_obj
+
     def grad_P_pen(self, pi_est, xi_ext):
         """Computes the gradient of the sub objective P with penalty
 
@@ -153,15 +266,15 @@ class MstepFunctions:
         output : `np.ndarray`
             The value of the P sub objective gradient
         """
-        fit_intercept = self.fit_intercept
-        n_time_indep_features = self.n_time_indep_features
+        fit_intercept = int(self.fit_intercept)
+        p, dim = self.n_time_indep_features, len(xi_ext) // 2
         xi_0, xi = get_xi_from_xi_ext(xi_ext, fit_intercept)
+        grad_sub_obj = self.grad_P(pi_est, xi_ext)
+        # The intercept is not penalized
         grad_pen = self.ENet.grad(xi)
-        if fit_intercept:
-            grad_pen = np.concatenate([[0], grad_pen[:n_time_indep_features],
-                                       [0], grad_pen[n_time_indep_features:]])
-        grad_P = self.grad_P(pi_est, xi_ext)
-        return grad_P + grad_pen
+        grad_sub_obj[fit_intercept:dim] += grad_pen[:p]
+        grad_sub_obj[dim + fit_intercept:] += grad_pen[p:]
+        return grad_sub_obj
 
     def R_func(self, beta_k, *args):
         """Computes the function denoted R in the lights paper
@@ -178,35 +291,32 @@ class MstepFunctions:
         """
         delta = self.delta.reshape(-1, 1)
         arg = args[0]
-        baseline_val = arg["baseline_hazard"].values.flatten()
-        ind_1, ind_2 = arg["ind_1"] * 1, arg["ind_2"] * 1
+        ind_1, baseline_ind_2 = arg["ind_1"], arg["baseline_ind_2"]
         group = arg["group"]
         beta_k = beta_k.reshape(-1, 1)
         gamma_k = arg["gamma"][group]
         pi_est = arg["pi_est"][group]
-        E_g1 = arg["E_g1"](beta_k).T[group].T
+        E_g1 = self._get_E_g_group(arg, "E_g1", beta_k)
         E_g4, E_g5 = arg["E_g4"], arg["E_g5"]
         phi = arg["phi"]
 
-        op1 = (delta * (self.F_f.dot(beta_k.flatten())
-                        + (self.F_r.swapaxes(0, 1)[..., np.newaxis]
-                        * E_g5.T).sum(axis=2).T).dot(gamma_k.flatten()) * ind_1
-               - (E_g1 * baseline_val * ind_2)).sum(axis=1)
-
-        extracted_features = arg["extracted_features"]
-        U_list, V_list, y_list, N_list = extracted_features[0]
-        n_samples, n_long_features = self.n_samples, self.n_long_features
-        op2 = np.zeros(shape=n_samples)
-        for i in range(n_samples):
-            U_i, V_i, y_i, n_i = U_list[i], V_list[i], y_list[i], N_list[i]
-            M_i = U_i.dot(beta_k) + V_i.dot(E_g5[i]).reshape(-1, 1)
-            Phi_i = [[1 / phi[l, 0]] * n_i[l] for l in range(n_long_features)]
-            Phi_i = np.concatenate(Phi_i).reshape(-1, 1)
-            Sigma_i = np.diag(Phi_i.flatten())
-            op2[i] = (M_i * y_i).T.dot(Phi_i) - .5 * multi_dot(
-                [beta_k.T, U_i.T, Sigma_i]).dot(
-                U_i.dot(beta_k) + 2 * V_i.dot(E_g5[i].reshape(-1, 1))) + np.trace(
-                multi_dot([V_i.T, Sigma_i, V_i]).dot(E_g4[i]))
+        gamma_k = gamma_k.flatten()
+        asso = self.F_f.dot(beta_k.flatten()).dot(gamma_k) \
+            + E_g5.dot(np.einsum('jas,a->sj', self.F_r, gamma_k))
+        op1 = (delta * asso * ind_1 - E_g1 * baseline_ind_2).sum(axis=1)
+
+        n_samples = self.n_samples
+        # Measurements of all subjects stacked row-wise, the diagonal of
+        # Sigma_i being applied as a weight on each row
+        U, V, y, _, idx_sample, idx_feat = \
+            self._get_long_stack(arg["extracted_features"])
+        w = 1 / phi[idx_feat, 0]
+        U_beta = U.dot(beta_k.flatten())
+        V_E_g5 = (V * E_g5[idx_sample]).sum(axis=1)
+        V_E_g4_V = np.einsum('kr,krs,ks->k', V, E_g4[idx_sample], V)
+        op2 = np.bincount(idx_sample, minlength=n_samples, weights=w * (
+            (U_beta + V_E_g5) * y - .5 * U_beta * (U_beta + 2 * V_E_g5)
+            + V_E_g4_V))
         sub_obj = (pi_est * (op1 + op2)).sum()
 
         return -sub_obj / n_samples
@@ -224,36 +334,56 @@ class MstepFunctions:
         output : `np.ndarray`
             The value of the R gradient
         """
-        n_samples, alpha = self.n_samples, self.fixed_effect_time_order
-        delta, L = self.delta, self.n_long_features
-        q_l = alpha + 1
+        n_samples = self.n_samples
+        delta = self.delta
         arg = args[0]
-        baseline_val = arg["baseline_hazard"].values.flatten()
-        ind_1, ind_2 = arg["ind_1"] * 1, arg["ind_2"] * 1
+        ind_1, baseline_ind_2 = arg["ind_1"], arg["baseline_ind_2"]
         group = arg["group"]
         beta_k = beta_k.reshape(-1, 1)
-        E_g1 = arg["E_g1"](beta_k).T[group].T
+        E_g1 = self._get_E_g_group(arg, "E_g1", beta_k)
         E_g5 = arg["E_g5"]
         pi_est = arg["pi_est"][group]
         extracted_features = arg["extracted_features"]
         phi = arg["phi"]
         gamma_k = arg["gamma"][group].flatten()
         tmp = self.F_f.swapaxes(1, 2).dot(gamma_k)
-        m1 = ind_1.dot(tmp).T * delta - (baseline_val * E_g1 * ind_2).dot(tmp).T
-
-        (U_list, V_list, y_list, N_list) = extracted_features[0]
-        m2 = np.zeros((n_samples, L * q_l))
-        for i in range(n_samples):
-            U_i, V_i, n_i, y_i = U_list[i], V_list[i], N_list[i], y_list[i]
-            y_i = y_i.flatten()
-            Phi_i = [[1 / phi[l, 0]] * n_i[l] for l in range(L)]
-            Phi_i = np.diag(np.concatenate(Phi_i))
-            m2[i] = U_i.T.dot(Phi_i.dot(y_i - U_i.dot(beta_k.flatten()) -
-                                        V_i.dot(E_g5[i]))).flatten()
-
-        grad = (m1 + m2.T).dot(pi_est)
+        # Contracted over subjects first, leaving a single (J,) weight vector
+        w = (pi_est * delta).dot(ind_1) \
+            - pi_est.dot(E_g1 * baseline_ind_2)
+        m1 = w.dot(tmp)
+
+        # Measurements of all subjects stacked row-wise, along with the
+        # subject offsets and the longitudinal feature each row belongs to
+        U, V, y, offsets, _, idx_feat = \
+            self._get_long_stack(extracted_features)
+        m2 = grad_R_long(U, V, y, offsets, phi[idx_feat, 0], beta_k.flatten(),
+                         E_g5, pi_est)
+
+        grad = m1 + m2
         return -grad / n_samples
 
+    def R_func_and_grad(self, beta_k, *args):
+        """Computes both the function R and its gradient, the expectation
+        E_g1 of the E-step being evaluated only once
+
+        Parameters
+        ----------
+        beta_k : `np.ndarray`, shape=(n_long_features * q_l,)
+            Fixed effect parameters for group k
+
+        Returns
+        -------
+        R : `float`
+            The value of the R function
+
+        grad_R : `np.ndarray`
+            The value of the R gradient
+        """
+        arg = args[0]
+        E_g1 = arg["E_g1"](beta_k.reshape(-1, 1))
+        arg = {**arg, "E_g1": lambda v: E_g1}
+        return self.R_func(beta_k, arg), self.grad_R(beta_k, arg)
+
     def Q_func(self, gamma_k, *args):
         """Computes the function denoted Q in the lights paper.
 
@@ -271,19 +401,42 @@ class MstepFunctions:
         arg = args[0]
         group = arg["group"]
         gamma_k = gamma_k.reshape(-1, 1)
-        baseline_val = arg["baseline_hazard"].values.flatten()
-        ind_1, ind_2 = arg["ind_1"] * 1, arg["ind_2"] * 1
-        E_g1 = arg["E_g1"](gamma_k).T[group].T
-        E_log_g1 = arg["E_log_g1"](gamma_k).T[group].T
+        ind_1, baseline_ind_2 = arg["ind_1"], arg["baseline_ind_2"]
+        E_g1 = self._get_E_g_group(arg, "E_g1", gamma_k)
+        E_log_g1 = self._get_E_g_group(arg, "E_log_g1", gamma_k)
         pi_est = arg["pi_est"][group]
-        sub_obj = (E_log_g1 * ind_1).sum(axis=1) * delta - \
-                  (E_g1 * ind_2 * baseline_val).sum(axis=1)
+        sub_obj = np.einsum('ij,ij->i', E_log_g1, ind_1) * delta - \
+                  np.einsum('ij,ij->i', E_g1, baseline_ind_2)
         sub_obj = (pi_est * sub_obj).sum()
         return -sub_obj / n_samples
 
+    def Q_func_and_grad(self, gamma_k, *args):
+        """Computes both the function Q and its gradient with time dependence
+        association variable, the expectation E_g1 of the E-step being
+        evaluated only once
+
+        Parameters
+        ----------
+        gamma_k : `np.ndarray`, shape=(L * A,)
+            Time dependence association parameters for group k
+
+        Returns
+        -------
+        Q : `float`
+            The value of the Q function
+
+        grad_Q : `np.ndarray`
+            The value of the Q gradient with time dependence association
+            variable
+        """
+        arg = args[0]
+        E_g1 = arg["E_g1"](gamma_k.reshape(-1, 1))
+        arg = {**arg, "E_g1": lambda v: E_g1}
+        return self.Q_func(gamma_k, arg), self.grad_Q(gamma_k, arg)
+
     def Q_x_pen_func(self, gamma_x_k_ext, *args):
         """Computes the sub objective function Q with penalty, to be minimized
-        at each QNMCEM iteration using fmin_l_bfgs_b.
+        at each QNMCEM iteration using L-BFGS-B.
 
         Parameters
         ----------
@@ -303,6 +456,47 @@ class MstepFunctions:
         sub_obj = Q + pen
         return sub_obj
 
+    def Q_x_pen_func_and_grad(self, gamma_x_k_ext, *args):
+        """Computes both the sub objective Q with penalty and its gradient
+        along with time independence association variable, the expectations
+        of the E-step being evaluated only once
+
+        Parameters
+        ----------
+        gamma_x_k_ext : `np.ndarray`, shape=(2 * n_time_indep_features,)
+            The extension version of time independence association
+            parameters for group k
+
+        Returns
+        -------
+        sub_obj : `float`
+            The value of the Q sub objective to be minimized at each QNMCEM step
+
+        grad_sub_obj : `np.ndarray`
+            The value of the Q sub objective gradient with time
+            independence association variable and penalty
+        """
+        n_samples, delta = self.n_samples, self.delta
+        gamma_x_k = get_vect_from_ext(gamma_x_k_ext)
+        arg = args[0]
+        ind_1, baseline_ind_2 = arg["ind_1"], arg["baseline_ind_2"]
+        group = arg["group"]
+        gamma_x_k_col = gamma_x_k.reshape(-1, 1)
+        E_g1 = self._get_E_g_group(arg, "E_g1", gamma_x_k_col)
+        E_log_g1 = self._get_E_g_group(arg, "E_log_g1", gamma_x_k_col)
+        pi_est = arg["pi_est"][group]
+        # shared by Q and its gradient
+        E_g1_cum = np.einsum('ij,ij->i', E_g1, baseline_ind_2)
+        Q = (pi_est * (np.einsum('ij,ij->i', E_log_g1, ind_1) * delta
+                       - E_g1_cum)).sum()
+        grad = self.X.T.dot(pi_est * (delta - E_g1_cum)) / n_samples
+        sub_obj = -Q / n_samples + self.ENet.pen(gamma_x_k)
+        grad_sub_obj = self.ENet.grad(gamma_x_k)
+        p = len(grad)
+        grad_sub_obj[:p] -= grad
+        grad_sub_obj[p:] += grad
+        return sub_obj, grad_sub_obj
+
     def grad_Q_x_pen(self, gamma_x_k_ext, *args):
         """Computes the gradient of the sub objective Q along with time
          independence association variable and penalty
@@ -320,9 +514,9 @@ class MstepFunctions:
          independence association variable and penalty
         """
         gamma_x_k = get_vect_from_ext(gamma_x_k_ext)
-        grad_pen = self.ENet.grad(gamma_x_k)
-        grad_Q = self.grad_Q_x(gamma_x_k, *args)
-        return grad_Q + grad_pen
+        grad_sub_obj = self.grad_Q_x(gamma_x_k, *args)
+        grad_sub_obj += self.ENet.grad(gamma_x_k)
+        return grad_sub_obj
 
     def grad_Q_x(self, gamma_x_k, *args):
         """Computes the gradient of the function Q with time independence
@@ -341,15 +535,17 @@ class MstepFunctions:
         """
         n_samples, delta = self.n_samples, self.delta
         arg = args[0]
-        baseline_val = arg["baseline_hazard"].values.flatten()
-        ind_2 = arg["ind_2"] * 1
+        baseline_ind_2 = arg["baseline_ind_2"]
         group = arg["group"]
-        E_g1 = arg["E_g1"](gamma_x_k.reshape(-1, 1)).T[group].T
+        E_g1 = self._get_E_g_group(arg, "E_g1", gamma_x_k.reshape(-1, 1))
         pi_est = arg["pi_est"][group]
-        grad = (self.X.T * (pi_est * (delta -
-                    (E_g1 * baseline_val * ind_2).sum(axis=1)))).sum(axis=1)
-        grad_sub_obj = np.concatenate([grad, -grad])
-        return -grad_sub_obj / n_samples
+        E_g1_cum = np.einsum('ij,ij->i', E_g1, baseline_ind_2)
+        grad = self.X.T.dot(pi_est * (delta - E_g1_cum)) / n_samples
+        p = len(grad)
+        grad_sub_obj = np.empty(2 * p)
+        np.negative(grad, out=grad_sub_obj[:p])
+        grad_sub_obj[p:] = grad
+        return grad_sub_obj
 
     def grad_Q(self, gamma_k, *args):
         """Computes the gradient of the function Q  with time dependence
@@ -368,21 +564,18 @@ class MstepFunctions:
         """
         n_samples, delta = self.n_samples, self.delta
         arg = args[0]
-        baseline_val = arg["baseline_hazard"].values.flatten()
-        ind_1, ind_2 = arg["ind_1"] * 1, arg["ind_2"] * 1
+        ind_1, baseline_ind_2 = arg["ind_1"], arg["baseline_ind_2"]
         group = arg["group"]
         gamma_k = gamma_k.reshape(-1, 1)
         beta_k = arg["beta"][group]
-        E_g1 = arg["E_g1"](gamma_k).T[group].T
-        E_g6 = arg["E_g6"](gamma_k).T[group].T
+        E_g1 = self._get_E_g_group(arg, "E_g1", gamma_k)
+        E_g6 = self._get_E_g_group(arg, "E_g6", gamma_k)
         E_g5 = arg["E_g5"]
         pi_est = arg["pi_est"][group]
         F_f, F_r = self.F_f, self.F_r
-        op1 = (delta * (F_f.dot(beta_k.flatten())
-                 + (F_r.swapaxes(0, 1)[..., np.newaxis] * E_g5.T).sum(
-                    axis=2).T).T * ind_1.T * delta).sum(axis=1)
-        op2 = (((F_f.dot(beta_k.flatten()).T[..., np.newaxis] * E_g1.T)
-                + (F_r.swapaxes(0, 1)[..., np.newaxis] * E_g6.T).sum(axis=2))
-               .swapaxes(1,2) * baseline_val * ind_2).sum(axis=-1)
-        grad = ((op1 - op2) * pi_est).sum(axis=1)
+        # Weights of the event and of the at-risk terms, per subject and time
+        w_1 = (pi_est * delta)[:, None] * ind_1
+        w_2 = pi_est[:, None] * baseline_ind_2
+        grad = grad_Q_asso(w_1, w_2, E_g1, E_g5, E_g6,
+                           F_f.dot(beta_k.flatten()), F_r)
         return -grad / n_samples
@@ -55,8 +55,7 @@ class ElasticNet:
             The value of the elasticNet penalization part of vector v
         """
         l_pen, eta, = self.l_pen, self.eta
-        return l_pen * ((1. - eta) * abs(v).sum() +
-                        .5 * eta * np.linalg.norm(v) ** 2)
+        return l_pen * ((1. - eta) * abs(v).sum() + .5 * eta * np.vdot(v, v))
 
     def grad(self, v):
         """Computes the gradient of the elasticNet penalization of a vector v
@@ -73,13 +72,12 @@ class ElasticNet:
         """
         l_pen, eta = self.l_pen, self.eta
         dim = v.shape[0]
-        grad = np.zeros(2 * dim)
+        grad = np.empty(2 * dim)
+        # Gradient of ridge penalization
+        np.multiply(v, l_pen * eta, out=grad[:dim])
+        np.negative(grad[:dim], out=grad[dim:])
         # Gradient of lasso penalization
         grad += l_pen * (1 - eta)
-        # Gradient of ridge penalization
-        grad_pos = l_pen * eta * v
-        grad[:dim] += grad_pos
-        grad[dim:] -= grad_pos
         return grad
 
 
@@ -108,6 +106,15 @@ class SparseGroupL1:
         self.groups = groups
         self.L1 = L1Norm(l_pen * (1 - eta))
         self.GL1 = GroupL1(l_pen * eta, self.groups)
+        # Equal-sized adjacent groups tile a single block that can be reshaped
+        # to (n_groups, group_size), avoiding the loop over groups in copt
+        sizes = set(len(g) for g in groups)
+        adjacent = all(groups[i - 1][-1] + 1 == g[0]
+                       for i, g in enumerate(groups) if i > 0)
+        if len(sizes) == 1 and adjacent and len(groups[0]) > 0:
+            self._block = (groups[0][0], groups[-1][-1] + 1, len(groups[0]))
+        else:
+            self._block = None
 
     @property
     def l_pen(self):
@@ -143,8 +150,26 @@ class SparseGroupL1:
         self._groups = val
 
     def pen(self, v):
+        """Computes the Sparse group Lasso penalization of vector v
+
+        Parameters
+        ----------
+        v : `np.ndarray`
+            A coefficient vector
+
+        Returns
+        -------
+        output : `float`
+            The value of the Sparse group Lasso penalization of vector v
+        """
         L1 = self.L1.__call__(v)
-        GL1 = self.GL1.__call__(v)
+        if self._block is None:
+            GL1 = self.GL1.__call__(v)
+        else:
+            start, stop, size = self._block
+            block = v[start:stop].reshape(-1, size)
+            norms = np.sqrt(np.einsum('ij,ij->i', block, block))
+            GL1 = self.GL1.alpha * norms.sum()
         return L1 + GL1
 
     def prox(self, v, step_size):
@@ -166,4 +191,15 @@ class SparseGroupL1:
             The proximal operator of the Sparse group Lasso computed on vector v
         """
         L1_prox = self.L1.prox(v, step_size)
-        return self.GL1.prox(L1_prox, step_size)
+        if self._block is None:
+            return self.GL1.prox(L1_prox, step_size)
+        start, stop, size = self._block
+        thresh = step_size * self.GL1.alpha
+        block = L1_prox[start:stop].reshape(-1, size)
+        norms = np.sqrt(np.einsum('ij,ij->i', block, block))
+        # Block soft-thresholding, groups with norm below thresh are zeroed
+        scale = np.zeros_like(norms)
+        keep = norms > thresh
+        scale[keep] = 1 - thresh / norms[keep]
+        block *= scale[:, None]
+        return L1_prox
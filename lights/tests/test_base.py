@@ -4,7 +4,8 @@
 import unittest
 import numpy as np
 import pandas as pd
-from lights.base.base import get_xi_from_xi_ext, extract_features
+from lights.base.base import get_xi_from_xi_ext, extract_features, \
+    c_index, to_long_data, take_long_data
 
 
 class Test(unittest.TestCase):
@@ -63,6 +64,34 @@ class Test(unittest.TestCase):
         np.testing.assert_almost_equal(xi_0, xi_0_)
         np.testing.assert_almost_equal(xi, xi_)
 
+    def test_c_index(self):
+        """Test c_index function
+        """
+        T = np.array([1., 2., 2., 3., 4.])
+        delta = np.array([1, 1, 0, 0, 1])
+        risk = np.array([4., 3., 3., 1., 2.])
+        # admissible pairs: (0, 1..4), (1, 2..4); one tie on (1, 2)
+        np.testing.assert_almost_equal(c_index(risk, T, delta), 6.5 / 7)
+        # no event, hence no admissible pair
+        self.assertTrue(np.isnan(c_index(risk, T, np.zeros(5))))
+        # a nan risk score, even of a single subject, is not scored
+        risk[3] = np.nan
+        self.assertTrue(np.isnan(c_index(risk, T, delta)))
+        self.assertTrue(np.isnan(c_index(np.full(5, np.nan), T, delta)))
+
+    def test_take_long_data(self):
+        """Test to_long_data and take_long_data functions
+        """
+        data = [[pd.Series(np.array([2, 3, 5]), index=[1, 2, 3])],
+                [pd.Series(np.array([1, 3]), index=[2, 4])],
+                [pd.Series(np.array([4]), index=[1])]]
+        Y = pd.DataFrame(data=data, columns=['long_feature_1'])
+        times, values, offsets = take_long_data(to_long_data(Y),
+                                                np.array([2, 0]))[0]
+        np.testing.assert_almost_equal(times, [1, 1, 2, 3])
+        np.testing.assert_almost_equal(values, [4, 2, 3, 5])
+        np.testing.assert_almost_equal(offsets, [0, 1, 4])
+
 
 if __name__ == "main":
     unittest.main()
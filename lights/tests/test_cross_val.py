@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Author: Simon Bussy <simon.bussy@gmail.com>
+
+import unittest
+import numpy as np
+from unittest import mock
+from lights.cross_val import cross_validate
+from lights.tests.test_simu import get_train_data
+
+
+class Test(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = get_train_data(40)
+
+    def test_cross_validate(self):
+        """Tests the cross-validation results with the default learners
+        """
+        X, Y, T, delta = self.data
+        # 4 folds so that the folds after the first 3 ones are also run
+        output = cross_validate(X, Y, T, delta, n_folds=4, n_iter=2,
+                                verbose=False, random_state=1)
+        grid_params = output["grid_params"]
+        self.assertEqual(len(grid_params), 2)
+        self.assertIn(output["params_best"], grid_params)
+        avg_scores = output["avg_scores"]
+        self.assertEqual(avg_scores.shape, (2,))
+        self.assertTrue(np.all((avg_scores >= 0) & (avg_scores <= 1)))
+        # degenerate fits would all score the same
+        self.assertNotEqual(avg_scores[0], avg_scores[1])
+        self.assertEqual(output["params_best"],
+                         grid_params[np.argmax(avg_scores)])
+        n_scores = output["n_scores"]
+        self.assertTrue(np.all((n_scores >= 3) & (n_scores <= 4)))
+        learners = output["learners"]
+        self.assertEqual(len(learners), 4)
+        for learner in learners:
+            self.assertTrue(np.isfinite(learner.predict_marker(X, Y)).all())
+
+    def test_cross_validate_random_state(self):
+        """Tests the reproducibility of the randomized search
+        """
+        # the learners do not matter here, hence cheap ones
+        cv_args = dict(n_folds=4, n_iter=2, verbose=False,
+                       fixed_effect_time_order=1, max_iter=5,
+                       asso_functions=["lp", "re", "tps"])
+        grid_params_1 = cross_validate(*self.data, random_state=1,
+                                       **cv_args)["grid_params"]
+        grid_params_1_ = cross_validate(*self.data, random_state=1,
+                                        **cv_args)["grid_params"]
+        grid_params_2 = cross_validate(*self.data, random_state=2,
+                                       **cv_args)["grid_params"]
+        self.assertEqual(grid_params_1, grid_params_1_)
+        self.assertNotEqual(grid_params_1, grid_params_2)
+
+    def test_cross_validate_early_stopping(self):
+        """Tests the early stopping of the strength parameters unlikely to
+        beat the best ones
+        """
+        # scores on the successive folds, the grid being run through along a
+        # decreasing regularization path
+        scores = {(1., 0., 0.): [.8, .7, .9, .8, .8],
+                  (.1, 0., 0.): [.2, .3, .25, .9, .9]}
+
+        def fit_score_fold(learner, params, metric, train, test):
+            return learner, scores[params].pop(0)
+
+        with mock.patch("lights.cross_val._fit_score_fold", fit_score_fold):
+            output = cross_validate(*self.data, n_folds=5,
+                                    adaptative_grid_el=False,
+                                    grid_params=list(scores), verbose=False,
+                                    n_jobs=1)
+        np.testing.assert_equal(output["n_scores"], [5, 3])
+        np.testing.assert_almost_equal(output["avg_scores"], [.8, .25])
+        self.assertEqual(output["params_best"], (1., 0., 0.))
+
+        with self.assertRaises(ValueError):
+            cross_validate(*self.data, n_folds=1)
+
+
+if __name__ == "main":
+    unittest.main()
@@ -2,6 +2,9 @@
 # Author: Simon Bussy <simon.bussy@gmail.com>
 
 import unittest
+import numpy as np
+from scipy.stats import multivariate_normal
+from lights.base.base import extract_features
 from lights.inference import QNMCEM
 from lights.tests.test_simu import get_train_data
 
@@ -18,6 +21,21 @@ class Test(unittest.TestCase):
         qnmcem.fit(X, Y, T, delta)
         C_index = qnmcem.score(X, Y, T, delta)
 
+        # log-likelihood of the longitudinal submodel, in log scale
+        ext_feat = extract_features(Y, 1)
+        log_lik = qnmcem.mlmm_density(ext_feat)
+        (U_list, V_list, y_list, N), _ = ext_feat
+        theta = qnmcem.theta
+        D, phi = theta["long_cov"], theta["phi"]
+        beta_stack = np.hstack((theta["beta_0"], theta["beta_1"]))
+        for i in range(3):
+            cov = V_list[i].dot(D).dot(V_list[i].T) \
+                  + np.diag(np.repeat(phi[:, 0], N[i]))
+            mean = U_list[i].dot(beta_stack)
+            log_lik_ = [multivariate_normal.logpdf(y_list[i][:, 0], mean[:, k],
+                                                   cov) for k in range(2)]
+            np.testing.assert_allclose(log_lik[i], log_lik_, rtol=1e-10)
+
 
 if __name__ == "main":
     unittest.main()
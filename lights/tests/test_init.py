@@ -66,6 +66,14 @@ class Test(unittest.TestCase):
         ulmm = ULMM(fixed_effect_time_order=fixed_effect_time_order)
         self._test_initializer(ulmm)
 
+    def test_ULMM_numba(self):
+        """Tests ULMM estimation with the numba backend
+        """
+        fixed_effect_time_order = 1  # q_l=2 in the simulations
+        ulmm = ULMM(fixed_effect_time_order=fixed_effect_time_order,
+                    backend='numba')
+        self._test_initializer(ulmm)
+
     def test_MLMM(self):
         """Tests MLMM estimation
         """
@@ -3,10 +3,9 @@
 
 import unittest
 import numpy as np
-from lights.model.e_step_functions import EstepFunctions
 from lights.model.m_step_functions import MstepFunctions
 from lights.tests.testing_data import CreateTestingData
-from lights.base.base import get_ext_from_vect, get_times_infos
+from lights.base.base import get_times_infos
 
 
 class Test(unittest.TestCase):
@@ -25,13 +24,18 @@ class Test(unittest.TestCase):
         T_u = np.unique(T)
         J = len(T_u)
         asso_functions = data.asso_functions
-        _, self.ind_1, self.ind_2 = get_times_infos(T, T_u)
+        _, ind_1, ind_2 = get_times_infos(T, T_u)
+        # the M-step functions take float indicators
+        self.ind_1, self.ind_2 = ind_1.astype(float), ind_2.astype(float)
         self.M_func = MstepFunctions(fit_intercept, data.X, data.T, data.delta,
-                                     L, p, l_pen, eta_elastic_net,
-                                     data.nb_asso_feat, alpha, asso_functions)
-        self.xi_ext = np.array([0, 2, 1, 0])
+                                     L, p, l_pen, eta_elastic_net, alpha,
+                                     asso_functions)
+        self.xi_ext = np.array([0., 2., 1., 0.])
         self.pi_est = np.array([[.2, .4, .7], [.8, .6, .3]])
         self.data = data
+        # association part of gamma, the first p entries being the
+        # time-independent ones
+        self.gamma = [gamma_k[p:] for gamma_k in data.gamma]
         self.E_g1 = np.arange(1, 13).reshape(n_samples, J, K)
         self.E_g2 = np.array([1, 4, 5])
         self.E_g4 = .5 * np.ones(shape=(n_samples, r, r))
@@ -59,14 +63,15 @@ class Test(unittest.TestCase):
         """
         self.setUp()
         theta= self.data.theta
-        baseline_hazard, phi = theta["baseline_hazard"], theta["phi"]
-        beta, gamma = self.data.beta, self.data.gamma
+        baseline_ind_2 = self.ind_2 * theta["baseline_hazard"].values.flatten()
+        phi = theta["phi"]
+        beta, gamma = self.data.beta, self.gamma
         # for group 0
         E_g1 = lambda v: self.E_g1
         args = {"pi_est": self.pi_est, "E_g5": self.E_g5, "E_g4": self.E_g4,
-                    "gamma": gamma, "baseline_hazard": baseline_hazard,
+                    "gamma": gamma, "baseline_ind_2": baseline_ind_2,
                     "extracted_features": self.data.ext_feat, "phi": phi,
-                    "ind_1": self.ind_1, "ind_2": self.ind_2,
+                    "ind_1": self.ind_1,
                     "E_g1": E_g1, "group": 0}
         R = self.M_func.R_func(beta[0], {**args})
         R_ = 755.411
@@ -77,17 +82,18 @@ class Test(unittest.TestCase):
         """
         self.setUp()
         theta = self.data.theta
-        baseline_hazard, phi = theta["baseline_hazard"], theta["phi"]
-        beta, gamma = self.data.beta, self.data.gamma
+        baseline_ind_2 = self.ind_2 * theta["baseline_hazard"].values.flatten()
+        phi = theta["phi"]
+        beta, gamma = self.data.beta, self.gamma
         E_g1 = lambda v: self.E_g1
         args = {"pi_est": self.pi_est, "E_g5": self.E_g5, "E_g4": self.E_g4,
-                "gamma": gamma, "baseline_hazard": baseline_hazard,
+                "gamma": gamma, "baseline_ind_2": baseline_ind_2,
                 "extracted_features": self.data.ext_feat, "phi": phi,
-                "ind_1": self.ind_1, "ind_2": self.ind_2,
+                "ind_1": self.ind_1,
                 "E_g1": E_g1, "group": 0}
         grad_R = self.M_func.grad_R(beta[0], {**args})
-        grad_R_ = np.array([350.7, 494.383, 923.433, 166.467, -26.967,
-                             -1039.333, 86.433, 280.867, 908.8])
+        grad_R_ = np.array([402.033, 647.517, 1414.167, 237.133, 284.95,
+                            421.083, 83.433, 263.089, 827.467])
         np.testing.assert_almost_equal(grad_R, grad_R_, 3)
 
     def test_Q_func(self):
@@ -95,16 +101,17 @@ class Test(unittest.TestCase):
         """
         self.setUp()
         theta = self.data.theta
-        baseline_hazard, phi = theta["baseline_hazard"], theta["phi"]
-        beta, gamma = self.data.beta, self.data.gamma
+        baseline_ind_2 = self.ind_2 * theta["baseline_hazard"].values.flatten()
+        phi = theta["phi"]
+        beta, gamma = self.data.beta, self.gamma
         E_g1 = lambda v: self.E_g1
         E_log_g1 = lambda v: np.log(self.E_g1)
         E_g6 = lambda v: self.E_g6
         args = {"pi_est": self.pi_est, "E_g5": self.E_g5,
                     "phi": phi, "beta": beta,
-                    "baseline_hazard": baseline_hazard,
+                    "baseline_ind_2": baseline_ind_2,
                     "extracted_features": self.data.ext_feat,
-                    "ind_1": self.ind_1, "ind_2": self.ind_2,
+                    "ind_1": self.ind_1,
                     "E_g1": E_g1,"E_log_g1": E_log_g1,
                     "E_g6": E_g6, "group": 0}
         Q = self.M_func.Q_func(gamma[0], {**args})
@@ -116,23 +123,23 @@ class Test(unittest.TestCase):
         """
         self.setUp()
         theta = self.data.theta
-        baseline_hazard, phi = theta["baseline_hazard"], theta["phi"]
-        beta, gamma = self.data.beta, self.data.gamma
+        baseline_ind_2 = self.ind_2 * theta["baseline_hazard"].values.flatten()
+        phi = theta["phi"]
+        beta, gamma = self.data.beta, self.gamma
         E_g1 = lambda v: self.E_g1
         E_log_g1 = lambda v: np.log(self.E_g1)
         E_g6 = lambda v: self.E_g6
         args = {"pi_est": self.pi_est, "E_g5": self.E_g5,
                 "phi": phi, "beta": beta,
-                "baseline_hazard": baseline_hazard,
+                "baseline_ind_2": baseline_ind_2,
                 "extracted_features": self.data.ext_feat,
-                "ind_1": self.ind_1, "ind_2": self.ind_2,
+                "ind_1": self.ind_1,
                 "E_g1": E_g1, "E_log_g1": E_log_g1,
                 "E_g6": E_g6, "group": 0}
         grad_Q = self.M_func.grad_Q(gamma[0], {**args})
-        grad_Q_ = np.array([21.333, 103.733, 1953.667, 197.867, 218.267, 971,
-                            2575.083, 1625.767, 238.667, 259.067, 788.8,
-                            2086.917, 1047.967, 279.467, 299.867, 202.467,
-                            1845.9])
+        grad_Q_ = np.array([1953.667, 197.867, 218.267, 971, 2575.083,
+                            1625.767, 238.667, 259.067, 788.8, 2086.917,
+                            1047.967, 279.467, 299.867, 202.467, 1845.9])
         np.testing.assert_almost_equal(grad_Q, grad_Q_, 3)
 
 